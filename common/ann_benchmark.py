@@ -0,0 +1,120 @@
+"""Recall-vs-latency benchmark of approximate FAISS indexes against the exact flat index.
+
+Vectors come from a vector store saved with the ``Flat`` spec (``--store``) or are generated
+(``--synthetic N``) to project to a larger corpus. A sample of them is held out as queries and
+the flat index provides the true neighbours. Every spec is trained and filled once, then its
+search knob (nprobe for IVF, efSearch for HNSW) is swept, printing recall@k, p50/p99
+single-query latency and index size, so the setting that meets a latency target with enough
+recall can be put into ``FAISS_INDEX`` / ``FAISS_SEARCH_PARAMS``.
+
+    python common/ann_benchmark.py --store langchain/faiss_store --kinds ivf hnsw
+    python common/ann_benchmark.py --synthetic 200000 --dimension 3072 --kinds ivf ivfpq opq hnsw
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common.ann_index import create_index, has_ivf, index_spec, set_search_params, train_if_needed
+from common.vector_store import MANIFEST_FILE
+
+NPROBE = (1, 2, 4, 8, 16, 32, 64, 128)
+EF_SEARCH = (16, 32, 64, 128, 256, 512)
+
+
+def store_vectors(directory):
+    manifest = json.loads((Path(directory) / MANIFEST_FILE).read_text(encoding="utf-8"))
+    index = faiss.read_index(str(Path(directory) / manifest["index"]))
+    # read_index returns the base Index class for the wrapped index, downcast before checking its type
+    if not isinstance(index, faiss.IndexIDMap2) or not isinstance(faiss.downcast_index(index.index), faiss.IndexFlat):
+        raise SystemExit(f"{directory} is not a Flat store, its vectors cannot be read back exactly")
+    return index.index.reconstruct_n(0, index.ntotal)
+
+
+def synthetic_vectors(n, dimension, clusters=1000, seed=0):
+    """Clustered unit vectors; uniform random ones would have no neighbourhood structure to find."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimension), dtype="float32")
+    vectors = centers[rng.integers(0, clusters, n)] + 0.5 * rng.standard_normal((n, dimension), dtype="float32")
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def search_latencies(index, queries, k):
+    """Neighbours and per-query latencies (one query per call, as served)."""
+    neighbours = np.empty((len(queries), k), dtype="int64")
+    latencies = []
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, found = index.search(query[None, :], k)
+        latencies.append(time.perf_counter() - start)
+        neighbours[i] = found[0]
+    return neighbours, np.array(latencies)
+
+
+def recall_at_k(found, truth):
+    return np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)])
+
+
+def benchmark(vectors, specs, k=10, n_queries=200):
+    faiss.omp_set_num_threads(1)  # stable single-query numbers
+    rng = np.random.default_rng(0)
+    held_out = rng.choice(len(vectors), min(n_queries, len(vectors) // 10 or 1), replace=False)
+    queries = vectors[held_out]
+    base = np.delete(vectors, held_out, axis=0)
+    ids = np.arange(len(base), dtype="int64")
+
+    flat = faiss.IndexFlatL2(base.shape[1])
+    flat.add(base)
+    truth, flat_latencies = search_latencies(flat, queries, k)
+    print(f"{len(base)} vectors x {base.shape[1]} dims, {len(queries)} queries, recall@{k}")
+    print(f"{'spec':28} {'params':14} {'recall':>7} {'p50 ms':>8} {'p99 ms':>8} {'MB':>9} {'build s':>8}")
+    report = [("Flat", "", 1.0, flat_latencies, faiss.serialize_index(flat).nbytes, 0.0)]
+    for spec in specs:
+        start = time.perf_counter()
+        index = create_index(spec, base.shape[1])
+        try:
+            train_if_needed(index, base)
+        except RuntimeError as e:
+            # e.g. PQ codebooks need at least 256 training vectors
+            print(f"Skipping {spec}: {e}")
+            continue
+        index.add_with_ids(base, ids)
+        build_seconds = time.perf_counter() - start
+        size = faiss.serialize_index(index).nbytes
+        if has_ivf(index):
+            nlist = faiss.extract_index_ivf(index).nlist
+            sweep = [f"nprobe={n}" for n in NPROBE if n <= nlist]
+        elif "HNSW" in spec:
+            sweep = [f"efSearch={ef}" for ef in EF_SEARCH if ef >= k]
+        else:
+            sweep = [""]
+        for params in sweep:
+            set_search_params(index, params)
+            found, latencies = search_latencies(index, queries, k)
+            report.append((spec, params, recall_at_k(found, truth), latencies, size, build_seconds))
+    for spec, params, recall, latencies, size, build_seconds in report:
+        print(f"{spec:28} {params:14} {recall:7.3f} {np.percentile(latencies, 50) * 1000:8.3f} "
+              f"{np.percentile(latencies, 99) * 1000:8.3f} {size / 1e6:9.1f} {build_seconds:8.1f}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--store", help="vector store directory built with FAISS_INDEX=Flat")
+    source.add_argument("--synthetic", type=int, help="number of generated vectors")
+    parser.add_argument("--dimension", type=int, default=3072, help="dimension of generated vectors")
+    parser.add_argument("--kinds", nargs="*", default=["ivf", "ivfpq", "hnsw"],
+                        help="index kinds sized for the corpus: fp16, sq8, ivf, ivfsq8, ivfpq, opq, hnsw")
+    parser.add_argument("--specs", nargs="*", default=[], help="explicit FAISS factory strings to compare as well")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+    data = store_vectors(args.store) if args.store else synthetic_vectors(args.synthetic, args.dimension)
+    specs = [index_spec(kind, len(data), data.shape[1]) for kind in args.kinds] + args.specs
+    benchmark(data, specs, args.k, args.queries)
@@ -0,0 +1,84 @@
+"""FAISS index construction for the vector store: flat, scalar-quantized, IVF, IVF-PQ, OPQ and HNSW.
+
+Indexes are described with FAISS factory strings (``FAISS_INDEX``, e.g. ``SQ8``,
+``IVF1024,Flat``, ``OPQ96,IVF1024,PQ96`` or ``HNSW32``) and search knobs with parameter
+strings (``FAISS_SEARCH_PARAMS``, e.g. ``nprobe=16`` or ``efSearch=128``); ``index_spec``
+suggests a spec for a corpus size. IVF, PQ and SQ8 indexes must be trained before vectors are
+added, which ``train_if_needed`` does on the first batch. ``common/ann_benchmark.py`` measures
+recall and latency of candidate specs against the flat index.
+"""
+import math
+import os
+
+import faiss
+import numpy as np
+
+INDEX_SPEC = os.getenv("FAISS_INDEX", "Flat")
+SEARCH_PARAMS = os.getenv("FAISS_SEARCH_PARAMS", "")
+TRAIN_SAMPLE = 256 * 1024  # vectors used for k-means training, more adds time but not recall
+HNSW_M = 32  # graph neighbours per node
+
+
+def index_spec(kind, n_vectors, dimension):
+    """Factory string of index ``kind`` (flat, fp16, sq8, ivf, ivfsq8, ivfpq, opq, hnsw) sized for ``n_vectors``."""
+    nlist = max(1, int(4 * math.sqrt(n_vectors)))  # the usual 4*sqrt(n) inverted lists
+    pq_m = max(1, dimension // 32)  # bytes per vector; 3072 dims -> 96 bytes instead of 12 KB
+    specs = {
+        "flat": "Flat",
+        "fp16": "SQfp16",  # half the memory of float32, practically no recall loss
+        "sq8": "SQ8",  # a quarter of the memory, per-dimension min/max learned in training
+        "ivf": f"IVF{nlist},Flat",
+        "ivfsq8": f"IVF{nlist},SQ8",
+        "ivfpq": f"IVF{nlist},PQ{pq_m}",
+        "opq": f"OPQ{pq_m},IVF{nlist},PQ{pq_m}",
+        "hnsw": f"HNSW{HNSW_M},Flat",
+    }
+    return specs[kind]
+
+
+def has_ivf(index):
+    try:
+        faiss.extract_index_ivf(index)
+        return True
+    except RuntimeError:
+        return False
+
+
+def create_index(spec, dimension):
+    """Index from a factory string that accepts ``add_with_ids``.
+
+    IVF indexes keep the ids themselves; the others are wrapped in an ``IndexIDMap2``.
+    """
+    index = faiss.index_factory(dimension, spec, faiss.METRIC_L2)
+    return index if has_ivf(index) else faiss.IndexIDMap2(index)
+
+
+def train_if_needed(index, vectors):
+    if index.is_trained:
+        return
+    if len(vectors) > TRAIN_SAMPLE:
+        vectors = vectors[np.random.default_rng(0).choice(len(vectors), TRAIN_SAMPLE, replace=False)]
+    index.train(vectors)
+
+
+def set_search_params(index, params=SEARCH_PARAMS):
+    """Apply ``nprobe=..``/``efSearch=..`` style parameters; unknown ones raise."""
+    if params:
+        faiss.ParameterSpace().set_index_parameters(index, params)
+
+
+def remove_ids(index, ids, spec):
+    """Remove ``ids`` from ``index``; returns the index, rebuilt when it cannot delete (HNSW)."""
+    ids = np.array(ids, dtype="int64")
+    try:
+        index.remove_ids(ids)
+        return index
+    except RuntimeError:
+        pass
+    # HNSW graphs do not support deletion: rebuild from the remaining vectors
+    stored_ids = faiss.vector_to_array(index.id_map)
+    vectors = index.index.reconstruct_n(0, index.ntotal)
+    keep = ~np.isin(stored_ids, ids)
+    rebuilt = create_index(spec, index.d)
+    rebuilt.add_with_ids(vectors[keep], stored_ids[keep])
+    return rebuilt
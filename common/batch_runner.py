@@ -0,0 +1,81 @@
+"""OpenAI Batch API runner for offline workloads.
+
+Requests are written to JSONL batch files (split at the API limits of 50,000 lines / 200 MB),
+uploaded and submitted together, then polled until they finish. Results are yielded per
+``custom_id`` so callers can merge them back by row/review ID as each batch completes.
+"""
+import json
+import os
+import tempfile
+import time
+
+CHAT_COMPLETIONS = "/v1/chat/completions"
+BATCH_MAX_REQUESTS = 50_000
+BATCH_MAX_BYTES = 190 * 1024 * 1024  # API limit is 200 MB, keep some headroom
+POLL_SECONDS = int(os.getenv("BATCH_POLL_SECONDS", "30"))
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def response_format_for(model_class):
+    """``response_format`` for a pydantic model, for request bodies that bypass ``parse``."""
+    return {"type": "json_schema",
+            "json_schema": {"name": model_class.__name__, "schema": model_class.model_json_schema()}}
+
+
+def submit_batch_file(client, batch_file, endpoint=CHAT_COMPLETIONS):
+    batch_file.seek(0)
+    uploaded = client.files.create(file=("batch.jsonl", batch_file), purpose="batch")
+    batch = client.batches.create(input_file_id=uploaded.id, endpoint=endpoint, completion_window="24h")
+    print(f"Submitted batch {batch.id}")
+    return batch.id
+
+
+def read_batch_results(client, batch):
+    """Yield (custom_id, response body) for every request of a finished batch; body is None on failure."""
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for line in client.files.content(file_id).text.splitlines():
+            item = json.loads(line)
+            response = item.get("response") or {}
+            if response.get("status_code") == 200:
+                yield item["custom_id"], response["body"]
+            else:
+                print(f"Batch request {item['custom_id']} failed: {item.get('error') or response.get('body')}")
+                yield item["custom_id"], None
+
+
+def iter_batch_results(client, requests, endpoint=CHAT_COMPLETIONS, poll_seconds=POLL_SECONDS):
+    """Run (custom_id, request body) pairs through the Batch API and yield (custom_id, response body).
+
+    Requests missing from the output (e.g. of an expired batch) are not yielded at all.
+    """
+    batch_ids = []
+    batch_file = None
+    for custom_id, body in requests:
+        line = json.dumps({"custom_id": custom_id, "method": "POST", "url": endpoint, "body": body},
+                          ensure_ascii=False).encode("utf-8") + b"\n"
+        if batch_file is not None and (line_count >= BATCH_MAX_REQUESTS or size + len(line) > BATCH_MAX_BYTES):
+            batch_ids.append(submit_batch_file(client, batch_file, endpoint))
+            batch_file.close()
+            batch_file = None
+        if batch_file is None:
+            batch_file = tempfile.TemporaryFile()
+            line_count = size = 0
+        batch_file.write(line)
+        line_count += 1
+        size += len(line)
+    if batch_file is not None:
+        batch_ids.append(submit_batch_file(client, batch_file, endpoint))
+        batch_file.close()
+
+    pending = list(batch_ids)
+    while pending:
+        for batch_id in list(pending):
+            batch = client.batches.retrieve(batch_id)
+            if batch.status in TERMINAL_STATUSES:
+                print(f"Batch {batch_id} {batch.status}: {batch.request_counts}")
+                pending.remove(batch_id)
+                yield from read_batch_results(client, batch)
+        if pending:
+            time.sleep(poll_seconds)
@@ -0,0 +1,161 @@
+"""Batched, concurrent and cached embedding requests for the RAG demos.
+
+Every vector is stored in a SQLite file keyed by a hash of (model, dimensions, text), so
+re-ingesting a lightly edited document only sends the chunks whose text changed. Cache misses
+are grouped into requests of at most ``MAX_BATCH_TOKENS`` tokens and ``MAX_BATCH_INPUTS``
+inputs, sent concurrently under the shared rate limiter. Vector sizes come from
+``EMBEDDING_DIMENSIONS``, so creating an index needs no probe request.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+from array import array
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from openai import OpenAI
+
+from common.rate_limiter import call_with_rate_limit, count_tokens
+
+try:
+    from langchain_core.embeddings import Embeddings
+except ImportError:
+    Embeddings = object
+
+EMBEDDING_DIMENSIONS = {
+    "text-embedding-3-large": 3072,
+    "text-embedding-3-small": 1536,
+    "text-embedding-ada-002": 1536,
+}
+MAX_BATCH_INPUTS = 2048  # API limit on inputs per request
+MAX_BATCH_TOKENS = 100_000  # below the 300k per-request limit, and small enough to keep several requests in flight
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", "4"))
+EMBEDDING_RETRIES = 2  # extra attempts after a 429, 5xx or dropped connection
+DEFAULT_PATH = Path(os.getenv("EMBEDDING_CACHE_PATH", Path.home() / ".cache" / "llm-demos" / "embeddings.sqlite"))
+CACHE_ENABLED = os.getenv("EMBEDDING_CACHE", "1") != "0"
+
+_client = None
+
+
+def embedding_dimension(model, dimensions=None):
+    """Vector size of ``model``, or the reduced size requested with ``dimensions``."""
+    if dimensions:
+        # only the text-embedding-3 models are trained so that a prefix of the vector still works
+        if not model.startswith("text-embedding-3"):
+            raise ValueError(f"{model} does not support reduced dimensions")
+        return dimensions
+    try:
+        return EMBEDDING_DIMENSIONS[model]
+    except KeyError:
+        raise ValueError(f"Unknown embedding model {model}, add its dimension to EMBEDDING_DIMENSIONS")
+
+
+def embedding_key(model, dimensions, text):
+    return hashlib.sha256(f"{model}\0{dimensions or ''}\0{text}".encode()).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = Path(path)
+        self.stats = Counter()
+        self.lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+
+    def get_many(self, keys):
+        """{key: vector} for the keys that are cached."""
+        found = {}
+        keys = list(keys)
+        with self.lock:
+            for start in range(0, len(keys), 500):  # stays below SQLite's bound-parameter limit
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk)
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+            self.stats["hits"] += len(found)
+            self.stats["misses"] += len(keys) - len(found)
+        return found
+
+    def set_many(self, items):
+        with self.lock:
+            self.conn.execute("BEGIN")
+            self.conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?)",
+                                  ((key, array("f", vector).tobytes()) for key, vector in items))
+            self.conn.execute("COMMIT")
+
+    def summary(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        hit_rate = self.stats["hits"] / lookups if lookups else 0.0
+        return (f"Embedding cache: {self.stats['hits']} hits, {self.stats['misses']} misses "
+                f"({hit_rate:.0%} hit rate), {self.stats['embedded_tokens']} tokens embedded "
+                f"in {self.stats['requests']} requests")
+
+
+shared_embedding_cache = EmbeddingCache() if CACHE_ENABLED else None
+
+
+def token_batches(pairs, max_tokens=MAX_BATCH_TOKENS, max_inputs=MAX_BATCH_INPUTS):
+    """Split (key, text) pairs into consecutive lists that each fit one embeddings request."""
+    batch, batch_tokens = [], 0
+    for key, text in pairs:
+        tokens = count_tokens(text)
+        if batch and (batch_tokens + tokens > max_tokens or len(batch) == max_inputs):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append((key, text))
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+def embed_texts(texts, model, dimensions=None, client=None, cache=shared_embedding_cache, workers=EMBEDDING_WORKERS):
+    """Embedding of every text in ``texts``, in order; only texts not in the cache are sent."""
+    global _client
+    if client is None:
+        # no SDK retries: they would bypass the shared limiter, call_with_rate_limit retries instead
+        _client = _client or OpenAI(max_retries=0)
+        client = _client
+    keys = [embedding_key(model, dimensions, text) for text in texts]
+    vectors = cache.get_many(set(keys)) if cache is not None else {}
+    missing = {key: text for key, text in zip(keys, texts) if key not in vectors}  # duplicates are sent once
+    extra = {"dimensions": dimensions} if dimensions else {}
+
+    def embed_batch(batch):
+        response = call_with_rate_limit(client.embeddings.with_raw_response.create, retries=EMBEDDING_RETRIES,
+                                        model=model, input=[text for _, text in batch], **extra)
+        embedded = [(key, item.embedding) for (key, _), item in zip(batch, response.data)]
+        if cache is not None:
+            cache.set_many(embedded)
+        return embedded, response.usage.total_tokens
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embed") as executor:
+        for embedded, tokens in executor.map(embed_batch, token_batches(missing.items())):
+            vectors.update(embedded)
+            if cache is not None:
+                cache.stats["requests"] += 1
+                cache.stats["embedded_tokens"] += tokens
+    return [vectors[key] for key in keys]
+
+
+class CachedEmbeddings(Embeddings):
+    """LangChain ``Embeddings`` that go through ``embed_texts`` (batching, concurrency and cache)."""
+
+    def __init__(self, model="text-embedding-3-large", dimensions=None, client=None, cache=shared_embedding_cache):
+        self.model = model
+        self.dimensions = dimensions
+        self.dimension = embedding_dimension(model, dimensions)
+        self.client = client
+        self.cache = cache
+
+    def embed_documents(self, texts):
+        return embed_texts(list(texts), self.model, self.dimensions, self.client, self.cache)
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
@@ -0,0 +1,204 @@
+"""Index advisor for the SQL the agents actually run.
+
+Replays the statements logged by ``query_cache.fetch_table`` with ``EXPLAIN QUERY PLAN``,
+proposes an index for every table that is scanned in full (equality columns first, then
+one range column, then ORDER BY columns, extended to a covering index when it stays small),
+tries each proposal on a scratch copy of the database, keeps it only if the logged workload
+gets faster and reports the before/after latency per query. ``--apply`` creates the kept
+indexes in the real database.
+
+    python common/index_advisor.py --db functions/db/movies.sqlite
+    python common/index_advisor.py --db functions/db/movies.sqlite --apply
+"""
+import argparse
+import json
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common.query_cache import SQL_LOG_PATH, normalize_sql
+
+MAX_INDEX_COLUMNS = 5  # wider covering indexes cost more on writes and disk than they save
+REPEAT = 20
+IMPROVEMENT_RATIO = 0.95  # an index must cut the weighted workload time by at least 5%
+
+_TABLE_REF = re.compile(r"\b(?:from|join)\s+[\"`\[]?(\w+)[\"`\]]?(?:\s+(?:as\s+)?(?!on\b|where\b|join\b|left\b|inner\b"
+                        r"|cross\b|group\b|order\b|limit\b|natural\b)(\w+))?")
+_COMPARISON = re.compile(r"(?:(\w+)\.)?(\w+)\s*(=|==|<>|!=|<=|>=|<|>|\bbetween\b|\blike\b|\bin\b|\bis\b)\s*(?:(\w+)\.)?(\w+)?")
+
+
+def load_logged_queries(log_path, db_path):
+    """Return [(normalized sql, example sql, count)] for one database, most frequent first."""
+    counts = Counter()
+    examples = {}
+    with open(log_path, encoding="utf-8") as log:
+        for line in log:
+            entry = json.loads(line)
+            if Path(entry["db"]) != db_path:
+                continue
+            key = normalize_sql(entry["sql"])
+            counts[key] += 1
+            examples.setdefault(key, entry["sql"])
+    return [(key, examples[key], count) for key, count in counts.most_common()]
+
+
+def table_columns(conn):
+    tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    return {table.lower(): [row[1].lower() for row in conn.execute(f'PRAGMA table_info("{table}")')]
+            for table in tables}
+
+
+def existing_indexes(conn, table):
+    """Column lists of the indexes already defined on ``table``."""
+    indexes = []
+    for row in conn.execute(f'PRAGMA index_list("{table}")'):
+        indexes.append([info[2].lower() for info in conn.execute(f'PRAGMA index_info("{row[1]}")') if info[2]])
+    return indexes
+
+
+def full_scans(conn, sql):
+    """Table names/aliases that the plan scans in full."""
+    plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    return {detail.split()[1].lower() for _, _, _, detail in plan
+            if detail.startswith("SCAN ") and " USING " not in detail and detail != "SCAN CONSTANT ROW"}, plan
+
+
+def propose_index(sql, table, alias, columns, tables_in_query):
+    """Index columns for ``table`` from the predicates and ORDER BY of a normalized query."""
+    def owned(qualifier, column):
+        if column not in columns:
+            return False
+        if qualifier:
+            return qualifier in (table, alias)
+        # an unqualified column belongs to this table only if no other table of the query has it
+        return not any(column in other for name, other in tables_in_query.items() if name != table)
+
+    predicates = " ".join(re.findall(r"\b(?:where|on)\b(.*?)(?=\bjoin\b|\bwhere\b|\bleft\b|\binner\b|"
+                                     r"\bcross\b|\bgroup by\b|\border by\b|\blimit\b|\bhaving\b|$)", sql))
+    equality, ranges, joins = [], [], []
+    for qualifier, column, operator, other_qualifier, other_column in _COMPARISON.findall(predicates):
+        column_is_other_table = other_column and not other_column.isdigit() and (
+            other_qualifier or any(other_column in cols for cols in tables_in_query.values()))
+        if operator in ("=", "==") and column_is_other_table:
+            # "x.a = t.b" is a join: an index on t.b only helps if t becomes the inner loop
+            for q, c in ((qualifier, column), (other_qualifier, other_column)):
+                if owned(q, c) and c not in joins:
+                    joins.append(c)
+            continue
+        target = equality if operator in ("=", "==", "in", "is") else ranges
+        if owned(qualifier, column) and column not in target:
+            target.append(column)
+    order_by = []
+    match = re.search(r"\border by\b(.*?)(?=\blimit\b|$)", sql)
+    if match:
+        for term in match.group(1).split(","):
+            qualifier, _, column = term.strip().split(" ")[0].rpartition(".")
+            if owned(qualifier, column):
+                order_by.append(column)
+
+    index = equality + [c for c in ranges[:1] if c not in equality]
+    # ORDER BY columns only help after equality columns, and only if no range column comes first
+    if not ranges:
+        index += [c for c in order_by if c not in index]
+    if not index:
+        index = joins
+    if not index:
+        return []
+    selected = re.match(r"select (.*?) from\b", sql)
+    if selected and selected.group(1).strip() != "*":
+        referenced = [column for qualifier, column in re.findall(r"(?:(\w+)\.)?(\w+)", selected.group(1))
+                      if owned(qualifier, column) and column not in index]
+        if len(index) + len(referenced) <= MAX_INDEX_COLUMNS:
+            index += referenced
+    return index
+
+
+def time_query(conn, sql, repeat=REPEAT):
+    """Best of ``repeat`` runs, the least noisy number for sub-millisecond queries."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        conn.execute(sql).fetchall()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def advise(db_path, log_path=SQL_LOG_PATH, apply=False, top=20):
+    db_path = Path(db_path).resolve()
+    queries = load_logged_queries(log_path, db_path)[:top]
+    if not queries:
+        print(f"No logged queries for {db_path} in {log_path}")
+        return []
+    # proposals are tried on a scratch copy so the shared database is untouched until --apply
+    scratch_dir = tempfile.TemporaryDirectory()
+    scratch = sqlite3.connect(Path(scratch_dir.name) / "scratch.sqlite")
+    with sqlite3.connect(f"{db_path.as_uri()}?mode=ro", uri=True) as source:
+        source.backup(scratch)
+    columns = table_columns(scratch)
+    proposals = {}  # index name -> (table, columns)
+    for normalized, sql, count in queries:
+        try:
+            scanned, _ = full_scans(scratch, sql)
+        except sqlite3.Error as e:
+            print(f"Skipping query that no longer runs ({e}): {sql}")
+            continue
+        references = {(alias or table): table for table, alias in _TABLE_REF.findall(normalized)}
+        tables_in_query = {table: columns.get(table, []) for table in references.values()}
+        for name in scanned:
+            table = references.get(name, name)
+            alias = next((a for a, t in references.items() if t == table and a != table), table)
+            index = propose_index(normalized, table, alias, columns.get(table, []), tables_in_query)
+            if not index or any(existing[:len(index)] == index for existing in existing_indexes(scratch, table)):
+                continue
+            proposals.setdefault(f"idx_{table}_{'_'.join(index)}", (table, index))
+    # an index whose columns are a prefix of another proposal on the same table is redundant
+    proposals = {name: (table, index) for name, (table, index) in proposals.items()
+                 if not any(other_table == table and len(other) > len(index) and other[:len(index)] == index
+                            for other_table, other in proposals.values())}
+
+    before = {sql: time_query(scratch, sql) for _, sql, _ in queries}
+    current = dict(before)
+    created = []
+    for name, (table, index) in proposals.items():
+        statement = f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}" ({", ".join(index)})'
+        scratch.execute(statement)
+        scratch.execute("ANALYZE")
+        timings = {sql: time_query(scratch, sql) for _, sql, _ in queries}
+        # keep the index only if the logged workload (weighted by frequency) gets clearly faster
+        if sum(count * timings[sql] for _, sql, count in queries) < IMPROVEMENT_RATIO * sum(
+                count * current[sql] for _, sql, count in queries):
+            created.append(statement)
+            current = timings
+        else:
+            scratch.execute(f'DROP INDEX "{name}"')
+    report = [(sql, count, before[sql], current[sql]) for _, sql, count in queries]
+    scratch.close()
+    scratch_dir.cleanup()
+
+    print("Proposed indexes:" if created else "No proposed index makes the logged queries faster.")
+    for statement in created:
+        print(f"  {statement};")
+    if apply and created:
+        with sqlite3.connect(db_path) as conn:
+            for statement in created:
+                conn.execute(statement)
+            conn.execute("ANALYZE")
+        print(f"Created {len(created)} indexes in {db_path}")
+    for sql, count, time_before, time_after in report:
+        print(f"{time_before * 1000:8.2f} ms -> {time_after * 1000:8.2f} ms  ({count}x) {sql}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", required=True, help="SQLite database the logged queries ran against")
+    parser.add_argument("--log", default=SQL_LOG_PATH, help="query log written by query_cache.fetch_table")
+    parser.add_argument("--apply", action="store_true", help="create the indexes that changed a query plan")
+    parser.add_argument("--top", type=int, default=20, help="number of most frequent queries to replay")
+    args = parser.parse_args()
+    advise(args.db, args.log, args.apply, args.top)
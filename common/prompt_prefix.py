@@ -0,0 +1,74 @@
+"""Prompt assembly that keeps provider prompt caching effective.
+
+OpenAI reuses the longest prompt prefix it has seen recently (for prompts of 1024 tokens or
+more, in 128-token steps), and tool definitions are part of that prefix. So the static parts
+of a prompt (tool definitions, instructions, the database schema) are assembled once, in a
+fixed order and with normalized whitespace, and everything that changes per request (the
+question, tool results) goes after them. ``PrefixCacheStats.record`` reads the cached prompt
+token count from the usage the API returns, so the hit rate can be checked.
+"""
+import threading
+import textwrap
+from collections import Counter
+
+
+class PromptPrefix:
+    """Byte-identical static prompt built from ``sections`` in the given order."""
+
+    def __init__(self, *sections):
+        self.text = "\n\n".join(textwrap.dedent(section).strip() for section in sections if section)
+
+    def system_message(self):
+        return {"role": "system", "content": self.text}
+
+    def messages(self, *dynamic):
+        """Static system message first, the per-request messages after it."""
+        return [self.system_message(), *dynamic]
+
+
+def _field(value, name):
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        return value.get(name)
+    return getattr(value, name, None)
+
+
+def prompt_tokens(usage):
+    return _field(usage, "prompt_tokens") or _field(usage, "input_tokens") or 0
+
+
+def cached_tokens(usage):
+    """Cached prompt tokens from Chat Completions, Responses API or LangChain usage data."""
+    for details, name in (("prompt_tokens_details", "cached_tokens"),  # chat completions
+                          ("input_tokens_details", "cached_tokens"),  # responses API
+                          ("input_token_details", "cache_read")):  # langchain usage_metadata
+        value = _field(_field(usage, details), name)
+        if value is not None:
+            return value
+    return 0
+
+
+class PrefixCacheStats:
+    def __init__(self):
+        self.stats = Counter()
+        self.lock = threading.Lock()
+
+    def record(self, usage):
+        if usage is None:
+            return
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["prompt_tokens"] += prompt_tokens(usage)
+            cached = cached_tokens(usage)
+            self.stats["cached_tokens"] += cached
+            self.stats["cache_hits"] += bool(cached)
+
+    def summary(self):
+        prompt = self.stats["prompt_tokens"]
+        cached_rate = self.stats["cached_tokens"] / prompt if prompt else 0.0
+        return (f"Prompt cache: {self.stats['cache_hits']}/{self.stats['requests']} requests hit, "
+                f"{self.stats['cached_tokens']} of {prompt} prompt tokens cached ({cached_rate:.0%})")
+
+
+shared_prefix_stats = PrefixCacheStats()
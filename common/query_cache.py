@@ -0,0 +1,147 @@
+"""Result cache for the SQL that agents send to ask_database.
+
+Queries are keyed by their normalized text (comments removed, whitespace collapsed and
+everything outside string literals lower-cased), so the same question phrased with different
+formatting hits the same entry. Entries are tied to the version of the database file (mtime
+and size of the file and its WAL) and dropped as soon as it changes. The cache is bounded by
+the approximate size of the cached rows and evicts least-recently-used entries.
+"""
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from pathlib import Path
+
+from common.query_guard import guarded_fetch
+from common.sqlite_pool import get_pool
+
+MAX_RESULT_BYTES = 32 * 1024 * 1024
+# every statement the agents run, replayed by common/index_advisor.py
+SQL_LOG_PATH = Path(os.getenv("SQL_LOG_PATH", Path.home() / ".cache" / "llm-demos" / "sql_queries.jsonl"))
+SQL_LOG_ENABLED = os.getenv("SQL_LOG", "1") != "0"
+_log_lock = threading.Lock()
+
+_LITERAL_OR_COMMENT = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")|(--[^\n]*|/\*.*?\*/)", re.S)
+
+
+def _normalize_code(text):
+    text = re.sub(r"\s+", " ", text.lower())
+    return re.sub(r" ?([(),=<>]) ?", r"\1", text)
+
+
+def normalize_sql(sql):
+    parts = []
+    code = []
+    position = 0
+    for match in _LITERAL_OR_COMMENT.finditer(sql):
+        code.append(sql[position:match.start()])
+        position = match.end()
+        if match.group(1):
+            # string literals are kept exactly as written
+            parts.append(_normalize_code("".join(code)))
+            parts.append(match.group(1))
+            code = []
+        else:
+            code.append(" ")  # comment
+    code.append(sql[position:])
+    parts.append(_normalize_code("".join(code)))
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def database_version(path):
+    """Cheap version stamp that changes whenever the database or its WAL is written."""
+    version = []
+    for file in (path, f"{path}-wal"):
+        try:
+            stat = os.stat(file)
+            version.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            version.append(None)
+    return tuple(version)
+
+
+def result_size(result):
+    columns, rows, _ = result
+    return sum(len(str(value)) + 8 for row in rows for value in row) + 16 * len(rows) + sum(map(len, columns))
+
+
+class QueryCache:
+    def __init__(self, max_bytes=MAX_RESULT_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # (db path, normalized sql) -> (db version, result, size)
+        self.size = 0
+        self.stats = Counter()
+        self.lock = threading.Lock()
+
+    def get(self, key, version):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] != version:
+                self._remove(key)
+                self.stats["invalidated"] += 1
+                entry = None
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[1]
+
+    def set(self, key, version, result):
+        size = result_size(result)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (version, result, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.stats["evicted"] += 1
+
+    def _remove(self, key):
+        self.size -= self.entries.pop(key)[2]
+
+    def summary(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        hit_rate = self.stats["hits"] / lookups if lookups else 0.0
+        return (f"Query cache: {self.stats['hits']} hits, {self.stats['misses']} misses ({hit_rate:.0%} hit rate), "
+                f"{self.stats['invalidated']} invalidated, {self.stats['evicted']} evicted, "
+                f"{len(self.entries)} entries / {self.size} bytes")
+
+
+shared_query_cache = QueryCache()
+
+
+def log_query(db_path, sql, elapsed_seconds, cached):
+    if not SQL_LOG_ENABLED:
+        return
+    entry = {"time": time.time(), "db": db_path, "sql": sql, "ms": round(elapsed_seconds * 1000, 3), "cached": cached}
+    with _log_lock:
+        SQL_LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
+        with open(SQL_LOG_PATH, "a", encoding="utf-8") as log:
+            log.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+def fetch_table(db_path, sql, cache=shared_query_cache):
+    """Run ``sql`` on the pooled read-only connection of ``db_path``, answering repeats from the cache.
+
+    Returns (column names, rows, more_rows) from the query guard, so rejected or timed-out queries
+    raise QueryRejected.
+    """
+    start = time.perf_counter()
+    path = str(Path(db_path).resolve())
+    key = (path, normalize_sql(sql))
+    version = database_version(path)
+    result = cache.get(key, version)
+    cached = result is not None
+    if not cached:
+        with get_pool(path).connection() as conn:
+            result = guarded_fetch(conn, sql)
+        cache.set(key, version, result)
+    log_query(path, sql, time.perf_counter() - start, cached)
+    columns, rows, more_rows = result
+    return list(columns), list(rows), more_rows
@@ -0,0 +1,68 @@
+"""Guarded execution of model-generated SQL.
+
+Before a query runs, its ``EXPLAIN QUERY PLAN`` is checked for nested full scans, i.e. a
+cross product of whole tables. While it runs, SQLite's progress handler aborts it after a
+wall-clock limit. Rows are fetched in chunks up to a cap, and the caller is told whether
+more rows exist.
+"""
+import os
+import sqlite3
+import time
+from collections import Counter
+
+MAX_ROWS = int(os.getenv("SQL_MAX_ROWS", "100"))
+TIMEOUT_SECONDS = float(os.getenv("SQL_TIMEOUT_SECONDS", "5"))
+PROGRESS_OPCODES = 10_000  # how often (in VM instructions) the deadline is checked
+FETCH_CHUNK_ROWS = 50
+
+
+class QueryRejected(Exception):
+    pass
+
+
+def full_scans_per_loop(plan):
+    """Count full table scans per nesting level of an EXPLAIN QUERY PLAN result."""
+    scans = Counter()
+    for _, parent, _, detail in plan:
+        if detail.startswith("SCAN ") and detail != "SCAN CONSTANT ROW":
+            scans[parent] += 1
+    return scans
+
+
+def check_plan(conn, sql):
+    """Raise QueryRejected when the plan joins two or more tables by scanning each of them in full."""
+    plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    for parent, count in full_scans_per_loop(plan).items():
+        if count > 1:
+            scanned = [detail for _, p, _, detail in plan if p == parent and detail.startswith("SCAN ")]
+            raise QueryRejected(f"Query rejected: it scans {', '.join(s[5:] for s in scanned)} in full for every "
+                                "combination of rows (a cross product). Join the tables on a key column or filter them first.")
+    return plan
+
+
+def guarded_fetch(conn, sql, max_rows=MAX_ROWS, timeout_seconds=TIMEOUT_SECONDS):
+    """Run ``sql`` after the plan check, with a deadline and at most ``max_rows`` rows.
+
+    Returns (column names, rows, more_rows) where ``more_rows`` is True when the result was capped.
+    """
+    check_plan(conn, sql)
+    deadline = time.monotonic() + timeout_seconds
+    conn.set_progress_handler(lambda: time.monotonic() > deadline, PROGRESS_OPCODES)
+    try:
+        cursor = conn.execute(sql)
+        columns = [column[0] for column in cursor.description or ()]
+        rows = []
+        while len(rows) <= max_rows:
+            chunk = cursor.fetchmany(min(FETCH_CHUNK_ROWS, max_rows + 1 - len(rows)))
+            if not chunk:
+                break
+            rows.extend(chunk)
+        cursor.close()
+    except sqlite3.OperationalError as e:
+        if str(e) == "interrupted":
+            raise QueryRejected(f"Query stopped after {timeout_seconds:g} seconds, make it more selective") from e
+        raise
+    finally:
+        conn.set_progress_handler(None, 0)
+    more_rows = len(rows) > max_rows
+    return columns, rows[:max_rows], more_rows
@@ -0,0 +1,222 @@
+"""Token-bucket rate limiter shared by every OpenAI caller in the process.
+
+Requests-per-minute and tokens-per-minute are tracked as two separate buckets.
+Token cost is estimated before a request is sent and corrected with the real usage
+afterwards. The ``x-ratelimit-*`` response headers resize the buckets to the limits
+the provider actually applies, so a job converges on the sustained limit instead of
+bursting into 429s.
+"""
+import asyncio
+import os
+import threading
+import time
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except ImportError:
+    _encoding = None
+
+CHARS_PER_TOKEN = 4  # rough estimate when tiktoken is not installed
+TOKENS_PER_MESSAGE = 4  # role, separators and other per-message overhead
+DEFAULT_COMPLETION_TOKENS = 256  # assumed output size when max_tokens is not set
+RETRY_BACKOFF_SECONDS = 1  # first pause before retrying a 5xx or dropped connection, doubled per attempt
+
+
+def count_tokens(text):
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def estimate_tokens(messages, max_tokens=None):
+    """Estimate prompt + completion tokens of a chat request before it is sent."""
+    prompt_tokens = 0
+    for message in messages:
+        content = message.get("content") if isinstance(message, dict) else getattr(message, "content", "")
+        prompt_tokens += TOKENS_PER_MESSAGE + count_tokens(str(content or ""))
+    return prompt_tokens + (max_tokens or DEFAULT_COMPLETION_TOKENS)
+
+
+def estimate_request_tokens(kwargs):
+    """Token estimate of a chat request, or of an embeddings request (``input``, no completion)."""
+    if "input" in kwargs and "messages" not in kwargs:
+        inputs = kwargs["input"]
+        return sum(count_tokens(str(text)) for text in ([inputs] if isinstance(inputs, str) else inputs))
+    return estimate_tokens(kwargs.get("messages", []), kwargs.get("max_tokens"))
+
+
+class TokenBucket:
+    """Bucket that refills ``capacity`` units per minute; ``capacity=None`` means unlimited."""
+
+    def __init__(self, capacity=None):
+        self.capacity = capacity
+        self.available = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        if self.capacity is not None:
+            elapsed = now - self.updated
+            self.available = min(self.capacity, self.available + elapsed * self.capacity / 60)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until ``amount`` units are available (call after ``refill``)."""
+        if self.capacity is None:
+            return 0.0
+        # a request bigger than the whole bucket only has to wait for a full bucket
+        amount = min(amount, self.capacity)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) * 60 / self.capacity
+
+    def consume(self, amount):
+        if self.capacity is not None:
+            self.available -= amount
+
+    def resize(self, capacity):
+        if capacity != self.capacity:
+            if self.capacity is None:
+                self.available = capacity
+            else:
+                self.available = min(self.available, capacity)
+            self.capacity = capacity
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Read initial limits from OPENAI_RPM / OPENAI_TPM; unset means "learn from headers"."""
+        rpm = os.getenv("OPENAI_RPM")
+        tpm = os.getenv("OPENAI_TPM")
+        return cls(int(rpm) if rpm else None, int(tpm) if tpm else None)
+
+    def _reserve(self, estimated_tokens):
+        """Take capacity if available, otherwise return the number of seconds to wait."""
+        with self.lock:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            wait = max(self.paused_until - now,
+                       self.requests.wait_time(1),
+                       self.tokens.wait_time(estimated_tokens))
+            if wait <= 0:
+                self.requests.consume(1)
+                self.tokens.consume(estimated_tokens)
+            return wait
+
+    def acquire(self, estimated_tokens, deadline=None):
+        """Block until one request and ``estimated_tokens`` tokens fit in the limits.
+
+        Raises ``TimeoutError`` instead of waiting past ``deadline`` (a ``time.monotonic()`` value).
+        """
+        while (wait := self._reserve(estimated_tokens)) > 0:
+            if deadline is not None and time.monotonic() + wait > deadline:
+                raise TimeoutError(f"rate limit wait of {wait:.1f}s exceeds the deadline")
+            time.sleep(wait)
+
+    async def acquire_async(self, estimated_tokens):
+        while (wait := self._reserve(estimated_tokens)) > 0:
+            await asyncio.sleep(wait)
+
+    def record_usage(self, estimated_tokens, actual_tokens):
+        """Give back (or charge) the difference between the estimate and the real usage."""
+        with self.lock:
+            self.tokens.consume(actual_tokens - estimated_tokens)
+
+    def update_from_headers(self, headers):
+        """Adapt the buckets to the ``x-ratelimit-*`` and ``retry-after`` response headers."""
+        with self.lock:
+            now = time.monotonic()
+            for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+                limit = headers.get(f"x-ratelimit-limit-{kind}")
+                remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+                if limit is not None:
+                    bucket.refill(now)
+                    bucket.resize(int(limit))
+                if remaining is not None and bucket.capacity is not None:
+                    bucket.available = min(bucket.available, int(remaining))
+            retry_after = headers.get("retry-after-ms")
+            retry_after = float(retry_after) / 1000 if retry_after else headers.get("retry-after")
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + float(retry_after))
+
+
+shared_limiter = RateLimiter.from_env()
+
+
+def _retryable(error):
+    """429s, 5xx and dropped connections are worth another attempt; timeouts and 4xx are not."""
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return type(error).__name__ == "APIConnectionError"
+
+
+def call_with_rate_limit(raw_create, limiter=None, retries=0, deadline=None, **kwargs):
+    """Run an openai ``with_raw_response`` create/parse call under the rate limiter.
+
+    Returns the parsed response, e.g.
+    ``call_with_rate_limit(client.chat.completions.with_raw_response.create, model=..., messages=...)``.
+    Retryable errors are retried up to ``retries`` times, each attempt waiting in the limiter
+    again (which honours ``retry-after``). With a ``deadline`` (a ``time.monotonic()`` value)
+    the limiter waits, backoffs and the HTTP timeout of every attempt all end by that time.
+    """
+    limiter = limiter or shared_limiter
+    estimate = estimate_request_tokens(kwargs)
+    for attempt in range(retries + 1):
+        limiter.acquire(estimate, deadline)
+        if deadline is not None:
+            kwargs["timeout"] = max(deadline - time.monotonic(), 0.001)
+        try:
+            raw_response = raw_create(**kwargs)
+        except Exception as e:
+            limiter.record_usage(estimate, 0)
+            response = getattr(e, "response", None)
+            if response is not None:
+                limiter.update_from_headers(response.headers)
+            backoff = RETRY_BACKOFF_SECONDS * 2 ** attempt
+            if attempt == retries or not _retryable(e) or (
+                    deadline is not None and time.monotonic() + backoff > deadline):
+                raise
+            if limiter.paused_until <= time.monotonic():  # no retry-after pause to wait out in acquire
+                time.sleep(backoff)
+            continue
+        limiter.update_from_headers(raw_response.headers)
+        response = raw_response.parse()
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            limiter.record_usage(estimate, usage.total_tokens)
+        return response
+
+
+async def call_with_rate_limit_async(raw_create, limiter=None, retries=0, **kwargs):
+    """``call_with_rate_limit`` for ``AsyncOpenAI`` clients."""
+    limiter = limiter or shared_limiter
+    estimate = estimate_request_tokens(kwargs)
+    for attempt in range(retries + 1):
+        await limiter.acquire_async(estimate)
+        try:
+            raw_response = await raw_create(**kwargs)
+        except Exception as e:
+            limiter.record_usage(estimate, 0)
+            response = getattr(e, "response", None)
+            if response is not None:
+                limiter.update_from_headers(response.headers)
+            if attempt == retries or not _retryable(e):
+                raise
+            if limiter.paused_until <= time.monotonic():
+                await asyncio.sleep(RETRY_BACKOFF_SECONDS * 2 ** attempt)
+            continue
+        limiter.update_from_headers(raw_response.headers)
+        response = raw_response.parse()
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            limiter.record_usage(estimate, usage.total_tokens)
+        return response
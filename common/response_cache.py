@@ -0,0 +1,117 @@
+"""Content-addressed on-disk cache for repeatable chat completions.
+
+Entries are keyed by a hash of the request fields that determine the answer (model,
+messages, tools, temperature, seed, response_format, ...). They live in a single SQLite
+file shared by all demos, expire after a TTL and are evicted least-recently-used once the
+cache grows past ``max_bytes``.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+DEFAULT_PATH = Path(os.getenv("LLM_CACHE_PATH", Path.home() / ".cache" / "llm-demos" / "responses.sqlite"))
+DEFAULT_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600))
+DEFAULT_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+CACHE_ENABLED = os.getenv("LLM_CACHE", "1") != "0"
+
+# request fields that change the response; anything else (timeout, stream options...) is ignored
+KEY_FIELDS = ("model", "messages", "tools", "functions", "tool_choice", "function_call", "temperature",
+              "top_p", "seed", "max_tokens", "response_format", "input", "instructions")
+
+
+def _to_json(value):
+    if isinstance(value, type) and hasattr(value, "model_json_schema"):
+        return {"pydantic": value.__name__, "schema": value.model_json_schema()}
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    if hasattr(value, "content"):  # langchain / semantic kernel message objects
+        return {"type": type(value).__name__, "content": value.content}
+    raise TypeError(f"Cannot build a cache key from {type(value).__name__}")
+
+
+def request_key(**request):
+    """Stable hash of the response-determining fields of a chat request."""
+    fields = {name: request[name] for name in KEY_FIELDS if request.get(name) is not None}
+    canonical = json.dumps(fields, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=_to_json)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path=DEFAULT_PATH, ttl_seconds=DEFAULT_TTL_SECONDS, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = Path(path)
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.stats = Counter()
+        self.lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,
+            created REAL NOT NULL, accessed REAL NOT NULL)""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            now = time.time()
+            if row is not None and now - row[1] > self.ttl_seconds:
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.stats["expired"] += 1
+                row = None
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            self.conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.stats["hits"] += 1
+            return row[0]
+
+    def set(self, key, value):
+        size = len(value.encode())
+        now = time.time()
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)", (key, value, size, now, now))
+            self._evict()
+
+    def _evict(self):
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall():
+            if total <= self.max_bytes:
+                break
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            self.stats["evicted"] += 1
+
+    def summary(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        hit_rate = self.stats["hits"] / lookups if lookups else 0.0
+        return (f"Response cache: {self.stats['hits']} hits, {self.stats['misses']} misses "
+                f"({hit_rate:.0%} hit rate), {self.stats['expired']} expired, {self.stats['evicted']} evicted")
+
+
+shared_cache = ResponseCache() if CACHE_ENABLED else None
+
+
+def cached_completion(call, response_type, cache=None, **request):
+    """Return ``call(**request)`` from the cache when an identical request was answered before.
+
+    ``response_type`` is the pydantic model the response is restored into, e.g. ``ChatCompletion``
+    or ``ParsedChatCompletion[MyFormat]``.
+    """
+    cache = cache or shared_cache
+    if cache is None:
+        return call(**request)
+    key = request_key(**request)
+    cached = cache.get(key)
+    if cached is not None:
+        return response_type.model_validate_json(cached)
+    response = call(**request)
+    cache.set(key, response.model_dump_json())
+    return response
@@ -0,0 +1,56 @@
+"""Compact, token-budgeted serialization of SQL results for tool messages.
+
+Column headers are emitted once, followed by one tab-separated (or markdown) line per row.
+Long text values are shortened, and rows past the token budget are dropped with a summary
+line, so the follow-up completion gets the data without Python reprs or unnamed columns.
+"""
+import os
+
+from common.rate_limiter import count_tokens
+
+MAX_TOKENS = int(os.getenv("SQL_RESULT_MAX_TOKENS", "1500"))
+MAX_FIELD_CHARS = 200
+
+
+def format_value(value, max_field_chars=MAX_FIELD_CHARS):
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return f"{value:g}"
+    if isinstance(value, bytes):
+        return f"<{len(value)} bytes>"
+    text = " ".join(str(value).split())  # tabs and newlines would break the table
+    if len(text) > max_field_chars:
+        text = text[:max_field_chars - 1] + "…"
+    return text
+
+
+def format_result(columns, rows, more_rows=False, style="tsv", max_tokens=MAX_TOKENS,
+                  max_field_chars=MAX_FIELD_CHARS):
+    """Serialize a query result as a tsv or markdown table that fits ``max_tokens``."""
+    if not rows:
+        return "No rows."
+
+    def line(values):
+        if style == "markdown":
+            return "| " + " | ".join(value.replace("|", "\\|") for value in values) + " |"
+        return "\t".join(values)
+
+    lines = [line(columns)]
+    if style == "markdown":
+        lines.append("|" + "---|" * len(columns))
+    used_tokens = sum(count_tokens(text) + 1 for text in lines)
+    shown = 0
+    for row in rows:
+        text = line([format_value(value, max_field_chars) for value in row])
+        tokens = count_tokens(text) + 1
+        if used_tokens + tokens > max_tokens:
+            break
+        lines.append(text)
+        used_tokens += tokens
+        shown += 1
+    if shown < len(rows):
+        lines.append(f"({len(rows) - shown} more rows of {len(rows)} not shown to stay within the token budget)")
+    if more_rows:
+        lines.append(f"(the query matched more than {len(rows)} rows, add a LIMIT or aggregate for the rest)")
+    return "\n".join(lines)
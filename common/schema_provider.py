@@ -0,0 +1,219 @@
+"""Database schema for the SQL agents, read from the database instead of hard-coded.
+
+Tables and views are introspected once through ``sqlite_master`` and the ``PRAGMA table_info``,
+``foreign_key_list`` and ``index_list`` pragmas, with row counts, the common values of
+categorical text columns and the format of date columns. Introspection scans every text
+column, so the result is saved as JSON under ``SCHEMA_CACHE_DIR`` and reused, across runs too,
+until the database file changes (same version stamp as the query cache).
+
+``schema_for`` renders one compact line per table, with types, keys, samples and indexes. The
+whole schema is used while it fits ``SCHEMA_TOKEN_BUDGET``. Larger databases are cut down to
+the tables whose names match the question, then the tables around them in the foreign-key
+graph, both the ones they reference and the fact tables that reference them, nearest first,
+until the budget is spent.
+
+    python common/schema_provider.py --db functions/db/Chinook.db --question "top selling genres"
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common.query_cache import database_version
+from common.rate_limiter import count_tokens
+from common.sqlite_pool import get_pool
+
+SAMPLE_VALUES = 3
+MAX_SAMPLE_CHARS = 40
+MAX_CATEGORIES = 20  # text columns with at most this many distinct values get samples
+SCHEMA_TOKEN_BUDGET = int(os.getenv("SCHEMA_TOKEN_BUDGET", "2000"))  # larger schemas are cut to the question
+TEXT_TYPES = ("CHAR", "CLOB", "TEXT")
+DATE_TYPES = ("DATE", "TIME")
+SCHEMA_CACHE_DIR = Path(os.getenv("SCHEMA_CACHE_DIR", Path.home() / ".cache" / "llm-demos" / "schemas"))
+
+_schemas = {}  # resolved db path -> (db version, tables)
+_lock = threading.Lock()
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _samples(conn, table, column, declared):
+    """Values that tell the model how to filter: one date to show its format, or the common categories."""
+    values = f"FROM {_quote(table)} WHERE {_quote(column)} IS NOT NULL AND {_quote(column)} != ''"
+    if any(t in declared for t in DATE_TYPES) or column.lower().endswith("date"):
+        return [str(value) for (value,) in conn.execute(f"SELECT {_quote(column)} {values} LIMIT 1")]
+    if not any(t in declared for t in TEXT_TYPES):
+        return []
+    distinct, filled = conn.execute(f"SELECT count(DISTINCT {_quote(column)}), count(*) {values}").fetchone()
+    if not distinct or distinct > MAX_CATEGORIES or distinct * 2 > filled:
+        return []  # names, titles and free text: samples would not help writing a WHERE clause
+    return [str(value)[:MAX_SAMPLE_CHARS] for (value,) in conn.execute(
+        f"SELECT {_quote(column)} {values} GROUP BY 1 ORDER BY count(*) DESC LIMIT {SAMPLE_VALUES}")]
+
+
+def read_schema(conn):
+    """[{name, kind, rows, columns, foreign_keys, indexes}] for every table and view of ``conn``."""
+    tables = []
+    objects = conn.execute("SELECT name, type FROM sqlite_master WHERE type IN ('table', 'view') "
+                           "AND name NOT LIKE 'sqlite_%' ORDER BY name").fetchall()
+    for name, kind in objects:
+        columns = []
+        for _, column, declared, notnull, _, pk in conn.execute(f"PRAGMA table_info({_quote(name)})"):
+            samples = []
+            if kind == "table" and not pk:
+                samples = _samples(conn, name, column, declared.upper())
+            columns.append({"name": column, "type": declared, "pk": bool(pk), "notnull": bool(notnull),
+                            "samples": samples})
+        foreign_keys = {}
+        indexes = []
+        rows = None
+        if kind == "table":
+            for row in conn.execute(f"PRAGMA foreign_key_list({_quote(name)})"):
+                foreign_keys[row[3]] = (row[2], row[4])  # column -> (table, column)
+            for _, index, unique, origin, _ in conn.execute(f"PRAGMA index_list({_quote(name)})"):
+                if origin == "pk":
+                    continue  # already shown as PK on the columns
+                indexed = [info[2] for info in conn.execute(f"PRAGMA index_info({_quote(index)})")]
+                indexes.append((indexed, bool(unique)))
+            rows = conn.execute(f"SELECT count(*) FROM {_quote(name)}").fetchone()[0]
+        tables.append({"name": name, "kind": kind, "rows": rows, "columns": columns,
+                       "foreign_keys": foreign_keys, "indexes": indexes})
+    return tables
+
+
+def _cache_file(path):
+    return SCHEMA_CACHE_DIR / (hashlib.sha256(path.encode()).hexdigest()[:16] + ".json")
+
+
+def _load_cached(path, version):
+    try:
+        cached = json.loads(_cache_file(path).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    return cached["tables"] if cached.get("path") == path and cached.get("version") == version else None
+
+
+def _save_cached(path, version, tables):
+    cache_file = _cache_file(path)
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        temporary = cache_file.with_suffix(f".{os.getpid()}.tmp")
+        temporary.write_text(json.dumps({"path": path, "version": version, "tables": tables}), encoding="utf-8")
+        os.replace(temporary, cache_file)
+    except OSError as e:
+        print(f"Schema of {path} not cached: {e}")
+
+
+def get_schema(db_path):
+    """Introspected tables of ``db_path``, read again only when the file has changed."""
+    path = str(Path(db_path).resolve())
+    version = json.loads(json.dumps(database_version(path)))  # tuples as lists, as read back from the file
+    with _lock:
+        cached = _schemas.get(path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+    tables = _load_cached(path, version)
+    if tables is None:
+        with get_pool(path).connection() as conn:
+            tables = json.loads(json.dumps(read_schema(conn)))
+        _save_cached(path, version, tables)
+    with _lock:
+        _schemas[path] = (version, tables)
+    return tables
+
+
+def _words(text):
+    # split camelCase and snake_case, drop a plural "s" so "albums" matches "Album"
+    words = re.findall(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+", text)
+    return {word.lower().rstrip("s") for word in words if len(word) > 2}
+
+
+def _neighbours(tables):
+    """{table: tables joined to it by a foreign key, in either direction}."""
+    neighbours = {table["name"]: set() for table in tables}
+    for table in tables:
+        for referenced, _ in table["foreign_keys"].values():
+            if referenced in neighbours and referenced != table["name"]:
+                neighbours[table["name"]].add(referenced)
+                neighbours[referenced].add(table["name"])
+    return neighbours
+
+
+def relevant_tables(tables, question, token_budget=SCHEMA_TOKEN_BUDGET):
+    """Tables sharing words with ``question`` and the tables joined to them, within ``token_budget``.
+
+    Joined tables are added breadth-first over the foreign keys, so the fact tables that point
+    at a matched dimension (InvoiceLine for Genre) come in as well as the ones it points to.
+    """
+    asked = _words(question)
+    scored = []
+    for table in tables:
+        score = 3 * len(asked & _words(table["name"]))
+        score += len(asked & set().union(*(_words(column["name"]) for column in table["columns"])))
+        if score:
+            scored.append((score, table["name"]))
+    layer = [name for _, name in sorted(scored, key=lambda item: -item[0])]
+    neighbours = _neighbours(tables)
+    rendered = {table["name"]: render_table(table) for table in tables}
+    selected, seen, spent = set(), set(layer), 0
+    while layer:
+        for name in layer:
+            tokens = count_tokens(rendered[name])
+            if spent + tokens <= token_budget:
+                selected.add(name)
+                spent += tokens
+        # only tables that made it in are expanded, a join path must not skip a missing table
+        layer = sorted({n for name in layer if name in selected for n in neighbours[name]} - seen)
+        seen.update(layer)
+    return [table for table in tables if table["name"] in selected]
+
+
+def render_table(table):
+    columns = []
+    for column in table["columns"]:
+        text = f"{column['name']} {column['type']}".rstrip()
+        if column["pk"]:
+            text += " PK"
+        elif column["notnull"]:
+            text += " NOT NULL"
+        if column["name"] in table["foreign_keys"]:
+            text += " -> {}.{}".format(*table["foreign_keys"][column["name"]])
+        if column["samples"]:
+            text += " e.g. " + ", ".join(repr(value) for value in column["samples"])
+        columns.append(text)
+    header = f"{table['name']} ({table['rows']} rows)" if table["kind"] == "table" else f"{table['name']} (view)"
+    line = f"{header}: {'; '.join(columns)}"
+    if table["indexes"]:
+        line += "\n  indexes: " + "; ".join(("unique " if unique else "") + "(" + ", ".join(indexed) + ")"
+                                         for indexed, unique in table["indexes"])
+    return line
+
+
+def schema_for(db_path, question=None, token_budget=SCHEMA_TOKEN_BUDGET):
+    """Compact schema of ``db_path``; over ``token_budget`` tokens, only the tables relevant to ``question``.
+
+    The rendering is deterministic, so it can be part of a cached prompt prefix as long as the
+    database stays the same; without a question it does not depend on anything else.
+    """
+    tables = get_schema(db_path)
+    schema = "\n".join(render_table(table) for table in tables)
+    if question and count_tokens(schema) > token_budget:
+        tables = relevant_tables(tables, question, token_budget) or tables
+        schema = "\n".join(render_table(table) for table in tables)
+    return schema
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", required=True, help="SQLite database to describe")
+    parser.add_argument("--question", help="only show tables relevant to this question in large databases")
+    parser.add_argument("--token-budget", type=int, default=SCHEMA_TOKEN_BUDGET)
+    args = parser.parse_args()
+    print(schema_for(args.db, args.question, args.token_budget))
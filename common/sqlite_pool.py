@@ -0,0 +1,78 @@
+"""Pooled, read-only SQLite connections for the ask_database tools.
+
+Connections are opened once with ``mode=ro`` and ``PRAGMA query_only``, mmap I/O and a larger
+page cache, then checked out and returned, so repeated tool calls reuse a warm page cache
+instead of opening the database file every time.
+"""
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+POOL_SIZE = 4
+MMAP_BYTES = 256 * 1024 * 1024
+CACHE_KIB = 64 * 1024  # PRAGMA cache_size takes KiB when negative
+CHECKOUT_TIMEOUT_SECONDS = 30
+
+
+class ReadOnlyPool:
+    def __init__(self, path, size=POOL_SIZE, mmap_bytes=MMAP_BYTES, cache_kib=CACHE_KIB):
+        self.path = Path(path).resolve()
+        if not self.path.exists():
+            # mode=ro would fail anyway, this gives a clearer error for a wrong working directory
+            raise FileNotFoundError(f"Database not found: {self.path}")
+        self.size = size
+        self.mmap_bytes = mmap_bytes
+        self.cache_kib = cache_kib
+        self.idle = queue.LifoQueue()  # most recently used first, its cache is the warmest
+        self.opened = 0
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(f"{self.path.as_uri()}?mode=ro", uri=True, check_same_thread=False)
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute(f"PRAGMA mmap_size = {self.mmap_bytes}")
+        conn.execute(f"PRAGMA cache_size = -{self.cache_kib}")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection for the duration of the ``with`` block."""
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                can_open = self.opened < self.size
+                if can_open:
+                    self.opened += 1
+            if can_open:
+                conn = self._connect()
+            else:
+                conn = self.idle.get(timeout=CHECKOUT_TIMEOUT_SECONDS)
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self.idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(path):
+    """Shared pool for a database file (paths are resolved against the working directory)."""
+    key = Path(path).resolve()
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ReadOnlyPool(key)
+        return _pools[key]
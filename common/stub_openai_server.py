@@ -0,0 +1,217 @@
+"""Minimal OpenAI-compatible stub server for exercising the shared client helpers offline.
+
+It answers ``POST /v1/chat/completions`` with a canned reply, enforces its own
+requests/tokens per minute and sends the same ``x-ratelimit-*`` headers as the real API,
+answering 429 with ``retry-after`` once a limit is exceeded.
+
+It also fakes the Batch API (``/v1/files``, ``/v1/batches``): uploaded batches are answered
+with the same canned replies and report ``completed`` after ``--batch-delay`` seconds.
+Requests with a ``json_schema`` response_format get a schema-shaped JSON reply.
+
+    python common/stub_openai_server.py --port 8089 --rpm 60 --tpm 20000
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=stub python main.py
+"""
+import argparse
+import itertools
+import json
+import threading
+import time
+from collections import deque
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+JSON_DEFAULTS = {"integer": 0, "number": 0.0, "string": "stub", "boolean": False, "array": [], "null": None}
+
+
+def reply_content(request):
+    """Canned reply, or a JSON document shaped like the requested json_schema."""
+    response_format = request.get("response_format") or {}
+    if response_format.get("type") != "json_schema":
+        return "stub reply"
+    schema = response_format["json_schema"]["schema"]
+    return json.dumps({name: JSON_DEFAULTS.get(field.get("type"), None)
+                       for name, field in schema.get("properties", {}).items()})
+
+
+def completion_body(request, number):
+    prompt_tokens = sum(len(str(m.get("content", ""))) // 4 + 4 for m in request.get("messages", []))
+    completion_tokens = 8
+    return {
+        "id": f"chatcmpl-stub-{number}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model", "stub"),
+        "choices": [{"index": 0, "finish_reason": "stop",
+                     "message": {"role": "assistant", "content": reply_content(request)}}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                  "total_tokens": prompt_tokens + completion_tokens},
+    }
+
+
+class StubState:
+    def __init__(self, rpm, tpm, latency, batch_delay=2.0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.latency = latency
+        self.batch_delay = batch_delay
+        self.files = {}  # file id -> (filename, purpose, content bytes)
+        self.batches = {}  # batch id -> batch object
+        self.ids = itertools.count(1)
+        self.window = deque()  # (timestamp, tokens) of accepted requests in the last minute
+        self.accepted = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def admit(self, tokens):
+        """Record a request and return (accepted, remaining_requests, remaining_tokens)."""
+        with self.lock:
+            now = time.monotonic()
+            while self.window and now - self.window[0][0] >= 60:
+                self.window.popleft()
+            used_tokens = sum(t for _, t in self.window)
+            accepted = len(self.window) < self.rpm and used_tokens + tokens <= self.tpm
+            if accepted:
+                self.window.append((now, tokens))
+                used_tokens += tokens
+                self.accepted += 1
+            else:
+                self.rejected += 1
+            return accepted, self.rpm - len(self.window), self.tpm - used_tokens
+
+    def retry_after(self):
+        with self.lock:
+            return max(0.0, 60 - (time.monotonic() - self.window[0][0])) if self.window else 0.0
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, payload, headers):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def not_found(self):
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}}, {})
+
+        def do_GET(self):
+            parts = self.path.rstrip("/").split("/")
+            if self.path.startswith("/v1/batches/") and parts[-1] in state.batches:
+                self.send_json(200, self.batch_status(state.batches[parts[-1]]), {})
+            elif self.path.startswith("/v1/files/") and parts[-1] == "content" and parts[-2] in state.files:
+                content = state.files[parts[-2]][2]
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+            else:
+                self.not_found()
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.path.endswith("/files"):
+                self.upload_file(body)
+                return
+            request = json.loads(body or b"{}")
+            if self.path.endswith("/batches"):
+                self.create_batch(request)
+            elif self.path.endswith("/chat/completions"):
+                self.chat_completion(request)
+            else:
+                self.not_found()
+
+        def upload_file(self, body):
+            message = BytesParser().parsebytes(
+                b"Content-Type: " + self.headers["Content-Type"].encode() + b"\r\n\r\n" + body)
+            fields = {part.get_param("name", header="content-disposition"): part for part in message.get_payload()}
+            file_id = f"file-stub-{next(state.ids)}"
+            content = fields["file"].get_payload(decode=True)
+            purpose = fields["purpose"].get_payload(decode=True).decode()
+            state.files[file_id] = (fields["file"].get_filename(), purpose, content)
+            self.send_json(200, {"id": file_id, "object": "file", "bytes": len(content),
+                                 "created_at": int(time.time()), "filename": fields["file"].get_filename(),
+                                 "purpose": purpose, "status": "processed"}, {})
+
+        def create_batch(self, request):
+            """Answer every line of the input file right away; the batch reports done after batch_delay."""
+            batch_id = f"batch-stub-{next(state.ids)}"
+            output_lines = []
+            for line in state.files[request["input_file_id"]][2].splitlines():
+                item = json.loads(line)
+                output_lines.append(json.dumps({
+                    "id": f"batch-req-{next(state.ids)}", "custom_id": item["custom_id"], "error": None,
+                    "response": {"status_code": 200, "request_id": "stub",
+                                 "body": completion_body(item["body"], next(state.ids))},
+                }))
+            output_file_id = f"file-stub-{next(state.ids)}"
+            state.files[output_file_id] = ("output.jsonl", "batch_output", "\n".join(output_lines).encode())
+            state.batches[batch_id] = {
+                "id": batch_id, "object": "batch", "endpoint": request["endpoint"], "errors": None,
+                "input_file_id": request["input_file_id"], "completion_window": request["completion_window"],
+                "output_file_id": output_file_id, "error_file_id": None, "created_at": int(time.time()),
+                "request_counts": {"total": len(output_lines), "completed": len(output_lines), "failed": 0},
+            }
+            self.send_json(200, self.batch_status(state.batches[batch_id]), {})
+
+        def batch_status(self, batch):
+            done = time.time() - batch["created_at"] >= state.batch_delay
+            status = dict(batch, status="completed" if done else "in_progress")
+            if not done:
+                status.update(output_file_id=None,
+                              request_counts={"total": batch["request_counts"]["total"], "completed": 0, "failed": 0})
+            return status
+
+        def chat_completion(self, request):
+            body = completion_body(request, state.accepted + 1)
+            accepted, remaining_requests, remaining_tokens = state.admit(body["usage"]["total_tokens"])
+            headers = {
+                "x-ratelimit-limit-requests": str(state.rpm),
+                "x-ratelimit-limit-tokens": str(state.tpm),
+                "x-ratelimit-remaining-requests": str(max(0, remaining_requests)),
+                "x-ratelimit-remaining-tokens": str(max(0, remaining_tokens)),
+            }
+            if not accepted:
+                headers["retry-after-ms"] = str(int(state.retry_after() * 1000))
+                self.send_json(429, {"error": {"message": "Rate limit reached", "type": "requests",
+                                               "code": "rate_limit_exceeded"}}, headers)
+                return
+            time.sleep(state.latency)
+            self.send_json(200, body, headers)
+
+    return Handler
+
+
+def serve(port=8089, rpm=60, tpm=20000, latency=0.2, batch_delay=2.0):
+    """Start the stub in a background thread and return the server (call ``shutdown()`` to stop)."""
+    state = StubState(rpm, tpm, latency, batch_delay)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    server.state = state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--rpm", type=int, default=60)
+    parser.add_argument("--tpm", type=int, default=20000)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per response")
+    parser.add_argument("--batch-delay", type=float, default=2.0, help="seconds until a batch completes")
+    args = parser.parse_args()
+    server = serve(args.port, args.rpm, args.tpm, args.latency, args.batch_delay)
+    print(f"Stub OpenAI server on http://127.0.0.1:{args.port}/v1 (rpm={args.rpm}, tpm={args.tpm})")
+    try:
+        while True:
+            time.sleep(5)
+            print(f"accepted={server.state.accepted} rejected={server.state.rejected}")
+    except KeyboardInterrupt:
+        server.shutdown()
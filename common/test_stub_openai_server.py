@@ -0,0 +1,68 @@
+"""Tests of the shared OpenAI helpers against the stub server (``pytest common``)."""
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+openai = pytest.importorskip("openai")
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common.batch_runner import iter_batch_results
+from common.rate_limiter import RateLimiter, call_with_rate_limit
+from common.stub_openai_server import serve
+
+RPM = 5
+
+
+@pytest.fixture
+def stub():
+    server = serve(port=0, rpm=RPM, tpm=100_000, latency=0.01, batch_delay=0.2)
+    client = openai.OpenAI(base_url=f"http://127.0.0.1:{server.server_address[1]}/v1", api_key="stub",
+                           max_retries=0)
+    yield server, client
+    server.shutdown()
+    server.server_close()
+
+
+def chat(client, limiter, deadline):
+    try:
+        return call_with_rate_limit(client.chat.completions.with_raw_response.create, limiter, deadline=deadline,
+                                    model="stub", messages=[{"role": "user", "content": "hi"}])
+    except (TimeoutError, openai.RateLimitError) as e:
+        return e
+
+
+def test_limiter_learns_rpm_from_headers(stub):
+    server, client = stub
+    limiter = RateLimiter()  # no configured limits, everything comes from the headers
+    deadline = time.monotonic() + 2
+    results = [chat(client, limiter, deadline) for _ in range(RPM * 2)]
+    assert limiter.requests.capacity == RPM
+    assert server.state.accepted == RPM
+    assert server.state.rejected == 0  # the limiter stops at the limit instead of hitting it
+    assert all(isinstance(result, TimeoutError) for result in results[RPM:])
+
+
+def test_concurrent_callers_get_one_wave_of_429s_at_most(stub):
+    server, client = stub
+    limiter = RateLimiter()
+    deadline = time.monotonic() + 2
+    workers = RPM + 3
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(lambda _: chat(client, limiter, deadline), range(workers * 3)))
+    # only requests sent before the first response taught the limiter the limit can be rejected,
+    # after a 429 the retry-after pause keeps everyone else waiting in the limiter
+    assert server.state.accepted == RPM
+    assert server.state.rejected <= workers
+    assert sum(isinstance(result, openai.RateLimitError) for result in results) == server.state.rejected
+
+
+def test_batch_results_keep_custom_ids(stub):
+    server, client = stub
+    requests = [(f"review-{i}", {"model": "stub", "messages": [{"role": "user", "content": f"review {i}"}]})
+                for i in range(5)]
+    results = dict(iter_batch_results(client, requests, poll_seconds=0.1))
+    assert sorted(results) == sorted(custom_id for custom_id, _ in requests)
+    assert all(body["choices"][0]["message"]["content"] == "stub reply" for body in results.values())
@@ -0,0 +1,50 @@
+"""Save/reload round trips of the vector store for each index kind (``pytest common``)."""
+import sys
+from pathlib import Path
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("faiss")
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common.vector_store import VectorStore
+
+DIMENSION = 8
+
+
+class FakeEmbeddings:
+    """Deterministic vectors per text, no API calls."""
+    model = "fake"
+    dimension = DIMENSION
+
+    def embed_documents(self, texts):
+        return [np.random.default_rng(sum(text.encode())).random(DIMENSION).tolist() for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def load_chunks(path):
+    return [(word, {"source": str(path)}) for word in path.read_text().split()]
+
+
+@pytest.mark.parametrize("spec", ["Flat", "SQ8", "HNSW32,Flat", "IVF4,Flat", "IVF4,SQ8", "IVF4,PQ2"])
+def test_saved_store_reloads(tmp_path, spec):
+    source = tmp_path / "source.txt"
+    source.write_text(" ".join(f"word{i}" for i in range(300)))  # enough vectors to train IVF and PQ
+    store = VectorStore.load(tmp_path / "store", FakeEmbeddings(), spec)
+    store.sync([source], load_chunks)
+    store.save()
+
+    reloaded = VectorStore.load(tmp_path / "store", FakeEmbeddings(), spec)
+    assert reloaded.mapped
+    assert reloaded.index.ntotal == 300
+    [(text, metadata, _)] = reloaded.search("word7", k=1)  # quantized indexes may return a neighbour
+    assert text.startswith("word") and metadata == {"source": str(source)}
+
+    # a second sync reads the mapped index back into memory and saves a new generation
+    source.write_text("changed")
+    assert reloaded.sync([source], load_chunks)["updated"] == 1
+    reloaded.save()
+    assert VectorStore.load(tmp_path / "store", FakeEmbeddings(), spec).index.ntotal == 1
@@ -0,0 +1,229 @@
+"""Incrementally updated FAISS store for the RAG demo.
+
+Each source document is tracked by path and content hash in ``manifest.json``, together with
+the ids of the chunks it produced. ``sync`` only chunks and embeds sources that are new or
+changed, and removes the chunks of changed or deleted sources by id, so updating a large
+corpus costs the delta instead of a full rebuild. The index type comes from a FAISS factory
+string (see ``common/ann_index.py``); approximate indexes are trained on the first sync.
+
+Loading is cheap regardless of corpus size: the index file is memory-mapped where FAISS
+supports it (it is read into memory only when a sync has something to change), and chunk
+text and metadata live in ``docstore.sqlite``, read by id for the hits of a search.
+
+Every save writes the index to a new file and then replaces the manifest, which names that
+file, so a crash leaves the previous index and manifest together. The docstore is committed
+in between; ``load`` compares its row count and the index size with the manifest and
+rebuilds a store that does not add up.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+from collections import Counter
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+from common.ann_index import INDEX_SPEC, SEARCH_PARAMS, create_index, remove_ids, set_search_params, train_if_needed
+
+INDEX_FILE = "index-{}.faiss"  # one file per save, numbered by generation; the manifest names the current one
+MANIFEST_FILE = "manifest.json"
+DOCSTORE_FILE = "docstore.sqlite"
+# IVF lists (and, in newer FAISS versions, flat codes) are mapped instead of read into memory.
+# FAISS rejects IO_FLAG_MMAP_IFC together with IO_FLAG_MMAP for IVF indexes, so the flag sets
+# are tried in this order and the first one the file accepts is used.
+MMAP_FLAGS = tuple(dict.fromkeys((
+    faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY | getattr(faiss, "IO_FLAG_MMAP_IFC", 0),
+    faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY,
+)))
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _replace_file(path, write):
+    """Write through a temporary file so a crash never leaves a half-written file under ``path``."""
+    temporary = path.with_name(path.name + ".tmp")
+    write(temporary)
+    os.replace(temporary, path)
+
+
+def read_mapped_index(path):
+    """Index at ``path``, memory-mapped with the first of ``MMAP_FLAGS`` that works for its type."""
+    for flags in MMAP_FLAGS[:-1]:
+        try:
+            return faiss.read_index(str(path), flags)
+        except RuntimeError:
+            pass
+    return faiss.read_index(str(path), MMAP_FLAGS[-1])
+
+
+class ChunkStore:
+    """Chunk text and metadata by id in SQLite; changes become visible on ``commit``."""
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS chunks (id INTEGER PRIMARY KEY, text TEXT NOT NULL, "
+                          "metadata TEXT NOT NULL)")
+
+    def add(self, chunks):
+        self.conn.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?)",
+                              ((chunk_id, text, json.dumps(metadata, ensure_ascii=False))
+                               for chunk_id, text, metadata in chunks))
+
+    def remove(self, ids):
+        self.conn.executemany("DELETE FROM chunks WHERE id = ?", ((chunk_id,) for chunk_id in ids))
+
+    def clear(self):
+        self.conn.execute("DELETE FROM chunks")
+
+    def count(self):
+        return self.conn.execute("SELECT count(*) FROM chunks").fetchone()[0]
+
+    def get(self, ids):
+        """{id: (text, metadata)} of the ``ids`` that exist."""
+        ids = [int(chunk_id) for chunk_id in ids]
+        rows = self.conn.execute(f"SELECT id, text, metadata FROM chunks WHERE id IN ({','.join('?' * len(ids))})",
+                                 ids)
+        return {chunk_id: (text, json.loads(metadata)) for chunk_id, text, metadata in rows}
+
+    def commit(self):
+        self.conn.commit()
+
+
+class VectorStore:
+    def __init__(self, directory, embeddings, spec=INDEX_SPEC, search_params=SEARCH_PARAMS):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.embeddings = embeddings
+        self.spec = spec
+        self.search_params = search_params
+        self.index = create_index(spec, embeddings.dimension)
+        set_search_params(self.index, search_params)
+        self.mapped = False  # True while the index is the read-only mapping of the saved file
+        self.sources = {}  # source path -> {"hash": content hash, "ids": [chunk ids]}
+        self.chunks = ChunkStore(self.directory / DOCSTORE_FILE)
+        self.next_id = 0
+        self.generation = 0  # number of the last saved index file
+        self.index_file = None  # name of the saved index file the manifest points to
+
+    @classmethod
+    def load(cls, directory, embeddings, spec=INDEX_SPEC, search_params=SEARCH_PARAMS):
+        """Store saved in ``directory``, or an empty one if there is none yet."""
+        store = cls(directory, embeddings, spec, search_params)
+        manifest_path = store.directory / MANIFEST_FILE
+        if not manifest_path.exists():
+            store.chunks.clear()
+            return store
+        manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+        store.generation = manifest.get("generation", 0)  # a rebuild must not overwrite the files it names
+        built_with = (manifest["model"], manifest["dimension"], manifest.get("spec", "Flat"),
+                      manifest.get("docstore"), "index" in manifest)
+        if built_with != (embeddings.model, embeddings.dimension, spec, DOCSTORE_FILE, True):
+            print(f"{directory} was built with {'/'.join(map(str, built_with[:4]))}, rebuilding")
+            store.chunks.clear()
+            return store
+        index = read_mapped_index(store.directory / manifest["index"])
+        expected = sum(len(entry["ids"]) for entry in manifest["sources"].values())
+        if index.ntotal != expected or store.chunks.count() != expected:
+            # e.g. a crash after the docstore commit of a save, before its manifest was written
+            print(f"{directory}: manifest lists {expected} chunks, index has {index.ntotal} and docstore "
+                  f"{store.chunks.count()}, rebuilding")
+            store.chunks.clear()
+            return store
+        store.index = index
+        store.mapped = True
+        set_search_params(store.index, search_params)
+        store.sources = manifest["sources"]
+        store.next_id = manifest["next_id"]
+        store.index_file = manifest["index"]
+        return store
+
+    def _make_writable(self):
+        """Read the mapped index into memory before the first change."""
+        if self.mapped:
+            self.index = faiss.read_index(str(self.directory / self.index_file))
+            set_search_params(self.index, self.search_params)
+            self.mapped = False
+
+    def save(self):
+        if not self.mapped:  # a mapped index is unchanged since it was loaded and keeps its file
+            self.generation += 1
+            self.index_file = INDEX_FILE.format(self.generation)
+            _replace_file(self.directory / self.index_file, lambda path: faiss.write_index(self.index, str(path)))
+        self.chunks.commit()
+        # replacing the manifest switches to the new index; until then the old one stays in use
+        manifest = {"model": self.embeddings.model, "dimension": self.embeddings.dimension, "spec": self.spec,
+                    "docstore": DOCSTORE_FILE, "index": self.index_file, "generation": self.generation,
+                    "next_id": self.next_id, "sources": self.sources}
+        _replace_file(self.directory / MANIFEST_FILE, lambda path: path.write_text(
+            json.dumps(manifest, indent=1), encoding="utf-8"))
+        for path in self.directory.glob("index*.faiss"):
+            if path.name != self.index_file:
+                path.unlink()
+
+    def remove_source(self, source):
+        self._make_writable()
+        ids = self.sources.pop(source)["ids"]
+        if ids:
+            index = remove_ids(self.index, ids, self.spec)
+            if index is not self.index:
+                self.index = index
+                set_search_params(self.index, self.search_params)
+        self.chunks.remove(ids)
+
+    def sync(self, paths, load_chunks):
+        """Bring the store in line with ``paths``; ``load_chunks(path)`` returns [(text, metadata)].
+
+        Returns counts of unchanged, added, updated and removed sources and of embedded chunks.
+        """
+        stats = Counter()
+        changed = {}
+        for path in paths:
+            source = str(path)
+            digest = file_hash(path)
+            entry = self.sources.get(source)
+            if entry is not None and entry["hash"] == digest:
+                stats["unchanged"] += 1
+                continue
+            stats["updated" if entry is not None else "added"] += 1
+            changed[source] = (digest, load_chunks(path))
+        for source in set(self.sources) - {str(path) for path in paths}:
+            self.remove_source(source)
+            stats["removed"] += 1
+
+        # the chunks of all changed sources are embedded together so they share batches
+        texts = [text for _, chunks in changed.values() for text, _ in chunks]
+        vectors = np.array(self.embeddings.embed_documents(texts) if texts else [], dtype="float32")
+        if len(vectors):
+            self._make_writable()
+            train_if_needed(self.index, vectors)
+        position = 0
+        for source, (digest, chunks) in changed.items():
+            if source in self.sources:
+                self.remove_source(source)
+            ids = list(range(self.next_id, self.next_id + len(chunks)))
+            self.next_id += len(chunks)
+            if chunks:
+                matrix = vectors[position:position + len(chunks)]
+                position += len(chunks)
+                self.index.add_with_ids(matrix, np.array(ids, dtype="int64"))
+            self.chunks.add((chunk_id, text, metadata) for chunk_id, (text, metadata) in zip(ids, chunks))
+            self.sources[source] = {"hash": digest, "ids": ids}
+            stats["chunks"] += len(chunks)
+        return stats
+
+    def search(self, query, k=4):
+        """[(text, metadata, L2 distance)] of the ``k`` chunks nearest to ``query``."""
+        vector = np.array([self.embeddings.embed_query(query)], dtype="float32")
+        distances, ids = self.index.search(vector, k)
+        # only the hits are read from the docstore
+        chunks = self.chunks.get(chunk_id for chunk_id in ids[0] if chunk_id != -1)
+        return [(*chunks[int(chunk_id)], float(distance))
+                for distance, chunk_id in zip(distances[0], ids[0]) if int(chunk_id) in chunks]
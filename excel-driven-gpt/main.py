@@ -1,25 +1,72 @@
 import datetime
+import hashlib
+import json
 import os
+import sys
 import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
+from pathlib import Path
+import httpx
 import openai
-import pandas
 from dotenv import load_dotenv
+from openai.types.chat import ChatCompletion
 
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common.batch_runner import iter_batch_results
+from common.rate_limiter import call_with_rate_limit
+from common.response_cache import cached_completion, shared_cache
+from sheet_io import SheetWriter, iter_rows, read_header
 
 load_dotenv()
 
-openai.api_key = os.getenv("OPENAI_API_KEY")
 MODEL = "gpt-3.5-turbo"
-DATA_FILE = 'data.xlsx'
-DATA_OUTPUT_XLSX = 'data_output.xlsx'
+DATA_FILE = os.getenv("DATA_FILE", 'data.xlsx')  # .xlsx or .csv
+DATA_OUTPUT_XLSX = os.getenv("DATA_OUTPUT_FILE", 'data_output.xlsx')  # .xlsx or .csv
+DATA_JOURNAL = 'data_output.journal.jsonl'  # completed rows, appended as they finish
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", "8"))  # max concurrent API calls, 1 = sequential
+CALL_TIMEOUT_SECONDS = 30  # seconds a row may take, rate-limit waits and retries included
+CALL_RETRIES = 2  # extra attempts after a 429, 5xx or dropped connection
+DEFAULT_RESPONSE = -1
+MAX_QUEUED_ROWS = MAX_IN_FLIGHT * 4  # rows read ahead of the API calls, keeps memory flat on big sheets
+BATCH_MODE = os.getenv("BATCH_MODE") == "1"  # send the sheet through the OpenAI Batch API instead
 
-def openai_call(system_message, input):
-    response = openai.chat.completions.create(
+# one connection pool sized to the executor, so open sockets never exceed MAX_IN_FLIGHT;
+# retries are done by call_with_rate_limit so they wait in the limiter and respect the row deadline
+client = openai.OpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    max_retries=0,
+    http_client=httpx.Client(limits=httpx.Limits(max_connections=MAX_IN_FLIGHT,
+                                                 max_keepalive_connections=MAX_IN_FLIGHT)),
+)
+executor = ThreadPoolExecutor(max_workers=MAX_IN_FLIGHT, thread_name_prefix="openai-call")
+call_stats = Counter()
+call_stats_lock = threading.Lock()
+
+
+def count_call(outcome):
+    with call_stats_lock:
+        call_stats[outcome] += 1
+
+
+def chat_messages(system_message, input):
+    return [
+        {"role": "system", "content": "" + system_message + ""},
+        {"role": "user", "content": "" + input + ""}
+    ]
+
+
+def openai_call(system_message, input, timeout=None):
+    # identical system/user pairs (e.g. a re-run of the same sheet) are answered from the cache
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    response = cached_completion(
+        partial(call_with_rate_limit, client.chat.completions.with_raw_response.create,
+                retries=CALL_RETRIES, deadline=deadline),
+        ChatCompletion,
         model=MODEL,
-        messages=[
-            {"role": "system", "content": "" + system_message + ""},
-            {"role": "user", "content": "" + input + ""}
-        ]
+        messages=chat_messages(system_message, input),
     )
     print(response)
     result = response.choices[0].message.content
@@ -27,43 +74,169 @@ def openai_call(system_message, input):
 
 
 def api_call_with_timeout(system_message, input, timeout_seconds, default_response):
-    response = [default_response]
+    # The timeout bounds the whole row: the limiter gives up instead of waiting past it, and the
+    # HTTP client aborts a request still running at that point and closes its connection, so
+    # nothing is left running in the background.
+    try:
+        result = openai_call(system_message, input, timeout=timeout_seconds)
+    except (openai.APITimeoutError, TimeoutError):
+        count_call('timed out')
+        return default_response
+    except Exception as e:
+        print(e)
+        count_call('failed')
+        return default_response
+    count_call('completed')
+    return result
 
-    def make_api_call():
-        try:
-            response[0] = openai_call(system_message, input)
-        except Exception as e:
-            print(e)
-            pass
 
-    thread = threading.Thread(target=make_api_call)
-    thread.start()
-    thread.join(timeout_seconds)
+def process_row(index, system_message, user_message):
+    try:
+        ai_response = api_call_with_timeout(system_message, user_message, CALL_TIMEOUT_SECONDS, DEFAULT_RESPONSE)
+    except Exception as e:
+        ai_response = e
+    return index, ai_response
+
+
+def row_fingerprint(system_message, user_message):
+    return hashlib.sha256((str(system_message) + '\0' + str(user_message)).encode()).hexdigest()[:16]
+
+
+def load_journal(path):
+    """Return {row index: (fingerprint, byte offset of the entry)} for rows completed by earlier runs.
+
+    Only offsets are kept in memory, answers are read back from the journal when the output is written.
+    """
+    entries = {}
+    if os.path.exists(path):
+        with open(path, 'rb+') as journal:
+            offset = 0
+            for line in journal:
+                if not line.endswith(b'\n'):
+                    # last line torn by a crash, drop it so the next entry starts on a fresh line
+                    journal.truncate(offset)
+                    break
+                entry = json.loads(line)
+                entries[entry['index']] = (entry['fingerprint'], offset)
+                offset += len(line)
+    return entries
+
+
+def append_journal(journal, journal_index, index, fingerprint, ai_response):
+    entry = {'index': index, 'fingerprint': fingerprint, 'assistant': str(ai_response)}
+    offset = journal.tell()
+    journal.write((json.dumps(entry, ensure_ascii=False) + '\n').encode('utf-8'))
+    journal.flush()
+    journal_index[index] = (fingerprint, offset)
 
-    if thread.is_alive():
-        return default_response
-    else:
-        return response[0]
+
+def run_rows(rows, journal_index, journal):
+    """Send the rows that are not in the journal to the API and append their answers to it.
+
+    At most MAX_QUEUED_ROWS rows are read ahead of the API calls. Returns the number of rows
+    restored from the journal.
+    """
+    restored_count = 0
+    call_count = 0
+    in_flight = {}  # future -> fingerprint of its row
+
+    def record(done):
+        nonlocal call_count
+        for future in done:
+            fingerprint = in_flight.pop(future)
+            index, ai_response = future.result()
+            call_count += 1
+            print('Call #' + str(call_count) + ' (row ' + str(index) + ')')
+            if ai_response == DEFAULT_RESPONSE:
+                continue  # failed rows are left out of the journal and retried on the next run
+            append_journal(journal, journal_index, index, fingerprint, ai_response)
+
+    try:
+        for index, row in rows:
+            fingerprint = row_fingerprint(row['SYSTEM MESSAGE'], row['USER'])
+            # rows already in the journal with unchanged prompts are not sent again
+            if journal_index.get(index, (None,))[0] == fingerprint:
+                restored_count += 1
+                continue
+            if len(in_flight) >= MAX_QUEUED_ROWS:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                record(done)
+            in_flight[executor.submit(process_row, index, row['SYSTEM MESSAGE'], row['USER'])] = fingerprint
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            record(done)
+    finally:
+        # rows that never started (e.g. after Ctrl+C) are cancelled instead of left queued
+        for future in in_flight:
+            if future.cancel():
+                count_call('abandoned')
+    return restored_count
+
+
+def run_rows_batch(rows, journal_index, journal):
+    """Same as run_rows, but the rows go through the Batch API and are merged back by custom_id."""
+    restored_count = 0
+
+    def batch_requests():
+        nonlocal restored_count
+        for index, row in rows:
+            fingerprint = row_fingerprint(row['SYSTEM MESSAGE'], row['USER'])
+            if journal_index.get(index, (None,))[0] == fingerprint:
+                restored_count += 1
+                continue
+            body = {"model": MODEL, "messages": chat_messages(row['SYSTEM MESSAGE'], row['USER'])}
+            yield 'row-' + str(index) + '-' + fingerprint, body
+
+    for custom_id, body in iter_batch_results(client, batch_requests()):
+        _, index, fingerprint = custom_id.split('-')
+        if body is None:
+            count_call('failed')
+            continue
+        count_call('completed')
+        append_journal(journal, journal_index, int(index), fingerprint, body['choices'][0]['message']['content'])
+    return restored_count
+
+
+def write_output(input_path, output_path, journal_index):
+    """Stream the input sheet again and write it out with the ASSISTANT answers from the journal."""
+    header = read_header(input_path)
+    columns = header if 'ASSISTANT' in header else header + ['ASSISTANT']
+    with open(DATA_JOURNAL, 'rb') as journal, SheetWriter(output_path, columns) as writer:
+        for index, row in iter_rows(input_path):
+            ai_response = DEFAULT_RESPONSE
+            fingerprint, offset = journal_index.get(index, (None, None))
+            if fingerprint == row_fingerprint(row['SYSTEM MESSAGE'], row['USER']):
+                journal.seek(offset)
+                ai_response = json.loads(journal.readline())['assistant']
+            # write content to ASSISTANT column of the row
+            row['ASSISTANT'] = ai_response
+            writer.write_row(row)
+
+
+def print_call_stats():
+    print('Calls completed: ' + str(call_stats['completed']) +
+          ', timed out: ' + str(call_stats['timed out']) +
+          ', failed: ' + str(call_stats['failed']) +
+          ', abandoned: ' + str(call_stats['abandoned']))
 
 
 if __name__ == '__main__':
     start_time = datetime.datetime.now()
-    dataframe = pandas.read_excel(DATA_FILE)
-    call_count = 0
-    # iterate through the rows of Excel file
-    for index, row in dataframe.iterrows():
-        system_message = row['SYSTEM MESSAGE']
-        user_message = row['USER']
+    journal_index = load_journal(DATA_JOURNAL)
+    with open(DATA_JOURNAL, 'ab') as journal:
         try:
-            call_count += 1
-            print('Call #' + str(call_count))
-            ai_response = api_call_with_timeout(system_message, user_message, 30, -1) # seconds to wait for openai to respond
-        except Exception as e:
-            ai_response = e
-        # write content to dataframe column and row
-        dataframe.at[index, 'ASSISTANT'] = ai_response
-    dataframe.to_excel(DATA_OUTPUT_XLSX, index=False)
+            if BATCH_MODE:
+                restored_count = run_rows_batch(iter_rows(DATA_FILE), journal_index, journal)
+            else:
+                restored_count = run_rows(iter_rows(DATA_FILE), journal_index, journal)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            client.close()
+            print_call_stats()
+            if shared_cache is not None:
+                print(shared_cache.summary())
+    print(str(restored_count) + ' rows restored from ' + DATA_JOURNAL)
+    # the output is built from the journal, rows that are still missing get the default response
+    write_output(DATA_FILE, DATA_OUTPUT_XLSX, journal_index)
     time_elapsed = (datetime.datetime.now() - start_time).total_seconds()
     print('Time elapsed: ' + str(time_elapsed) + ' seconds')
-
-
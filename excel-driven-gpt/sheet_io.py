@@ -0,0 +1,79 @@
+"""Row-streaming readers and writers for prompt sheets (.xlsx or .csv).
+
+xlsx files are opened with openpyxl in read-only / write-only mode and csv files with the
+csv module, so only the current row is held in memory whatever the size of the sheet.
+"""
+import csv
+from pathlib import Path
+import openpyxl
+
+
+def is_csv(path):
+    return Path(path).suffix.lower() == '.csv'
+
+
+def read_header(path):
+    """Return the column names from the first row of the sheet."""
+    if is_csv(path):
+        with open(path, newline='', encoding='utf-8') as sheet:
+            return next(csv.reader(sheet))
+    workbook = openpyxl.load_workbook(path, read_only=True)
+    try:
+        return list(next(workbook.active.iter_rows(values_only=True)))
+    finally:
+        workbook.close()
+
+
+def iter_rows(path):
+    """Yield (index, {column: value}) for every data row; index 0 is the row under the header.
+
+    Rows without any value (e.g. formatted but empty cells) are skipped as pandas did, but keep
+    their index so the ones after them still line up with the sheet.
+    """
+    if is_csv(path):
+        with open(path, newline='', encoding='utf-8') as sheet:
+            for index, row in enumerate(csv.DictReader(sheet)):
+                if any(value not in (None, '') for value in row.values()):
+                    yield index, row
+        return
+    workbook = openpyxl.load_workbook(path, read_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows)
+        for index, values in enumerate(rows):
+            if any(value is not None for value in values):
+                yield index, dict(zip(header, values))
+    finally:
+        workbook.close()
+
+
+class SheetWriter:
+    """Append-only writer; xlsx rows are streamed to disk by openpyxl's write-only workbook."""
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = columns
+
+    def __enter__(self):
+        if is_csv(self.path):
+            self.file = open(self.path, 'w', newline='', encoding='utf-8')
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(self.columns)
+        else:
+            self.workbook = openpyxl.Workbook(write_only=True)
+            self.sheet = self.workbook.create_sheet()
+            self.sheet.append(self.columns)
+        return self
+
+    def write_row(self, row):
+        values = [row.get(column) for column in self.columns]
+        if is_csv(self.path):
+            self.writer.writerow(values)
+        else:
+            self.sheet.append(values)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if is_csv(self.path):
+            self.file.close()
+        else:
+            self.workbook.save(self.path)
@@ -1,13 +1,104 @@
+import sys
+from pathlib import Path
 from termcolor import colored
 
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common.rate_limiter import TOKENS_PER_MESSAGE, count_tokens
+
+
+def message_tokens(message):
+    tokens = TOKENS_PER_MESSAGE + count_tokens(str(message.get("content") or ""))
+    for tool_call in message.get("tool_calls") or []:
+        tokens += count_tokens(tool_call["function"]["name"] + tool_call["function"]["arguments"])
+    return tokens
+
 
 class Conversation:
-    def __init__(self):
+    """Chat history with per-message token counts and optional compaction to a token budget.
+
+    When the history grows past ``token_budget``, tool/function results outside the last
+    ``keep_recent`` messages are cut to a short preview (the full text stays available in
+    ``tool_results`` under the reference shown in the preview). If that is not enough, the oldest
+    turns are replaced by a summary, either from ``summarizer(messages) -> str`` or the question
+    the user asked in each of them.
+    """
+
+    def __init__(self, token_budget=None, keep_recent=6, tool_preview_tokens=150, summarizer=None):
         self.conversation_history = []
+        self.token_counts = []
+        self.total_tokens = 0
+        self.token_budget = token_budget
+        self.keep_recent = keep_recent
+        self.tool_preview_tokens = tool_preview_tokens
+        self.summarizer = summarizer
+        self.tool_results = {}  # reference -> full content of a compacted tool/function result
+        self.summaries = []  # one entry per dropped turn
+        self.summary_index = None  # position of the system message holding them
 
     def add_message(self, role, content):
         message = {"role": role, "content": content}
+        self.append(message)
+
+    def append(self, message):
+        tokens = message_tokens(message)
         self.conversation_history.append(message)
+        self.token_counts.append(tokens)
+        self.total_tokens += tokens
+        if self.token_budget is not None and self.total_tokens > self.token_budget:
+            self.compact()
+
+    def _replace(self, index, message):
+        tokens = message_tokens(message)
+        self.total_tokens += tokens - self.token_counts[index]
+        self.conversation_history[index] = message
+        self.token_counts[index] = tokens
+
+    def compact(self):
+        older = len(self.conversation_history) - self.keep_recent
+        # 1. older tool results are kept by reference with only a preview re-sent
+        for index in range(older):
+            if self.total_tokens <= self.token_budget:
+                return
+            message = self.conversation_history[index]
+            if message["role"] not in ("tool", "function") or self.token_counts[index] <= self.tool_preview_tokens * 2:
+                continue
+            reference = f"result-{len(self.tool_results) + 1}"
+            self.tool_results[reference] = message["content"]
+            preview = []
+            for line in message["content"].splitlines():
+                if count_tokens("\n".join(preview + [line])) > self.tool_preview_tokens:
+                    break
+                preview.append(line)
+            omitted = message["content"].count("\n") + 1 - len(preview)
+            self._replace(index, dict(message, content="\n".join(preview) +
+                                      f"\n[{omitted} more lines omitted, full result kept as {reference}]"))
+        # 2. the oldest whole turns (a user message up to the next one) are folded into one summary
+        first = 0
+        while first < len(self.conversation_history) and self.conversation_history[first]["role"] == "system":
+            first += 1
+        while self.total_tokens > self.token_budget:
+            end = next((i for i in range(first + 1, older)
+                        if self.conversation_history[i]["role"] == "user"), None)
+            if end is None:
+                break  # only the recent turns are left, nothing more can be dropped safely
+            dropped = self.conversation_history[first:end]
+            if self.summarizer is not None:
+                self.summaries.append(self.summarizer(dropped))
+            else:
+                self.summaries += [f"- {m['content']}" for m in dropped if m["role"] == "user"]
+            self.total_tokens -= sum(self.token_counts[first:end])
+            del self.conversation_history[first:end]
+            del self.token_counts[first:end]
+            older -= end - first
+            summary = {"role": "system", "content": "Earlier turns of this conversation (compacted):\n" +
+                       "\n".join(self.summaries)}
+            if self.summary_index is None:
+                self.summary_index = first
+                self.conversation_history.insert(first, summary)
+                self.token_counts.insert(first, 0)
+                first += 1
+                older += 1
+            self._replace(self.summary_index, summary)
 
     def display_conversation(self, detailed=False):
         role_to_color = {
@@ -15,11 +106,15 @@ class Conversation:
             "user": "green",
             "assistant": "blue",
             "function": "magenta",
+            "tool": "magenta",
         }
         for message in self.conversation_history:
+            content = message["content"]
+            if detailed and "full result kept as " in str(content):
+                content = self.tool_results[content.rsplit("full result kept as ", 1)[1].rstrip("]")]
             print(
                 colored(
-                    f"{message['role']}: {message['content']}\n\n",
+                    f"{message['role']}: {content}\n\n",
                     role_to_color[message["role"]],
                 )
-            )
\ No newline at end of file
+            )
@@ -0,0 +1,67 @@
+"""Keep-alive HTTP session for the chat completions endpoint with per-request timings.
+
+One httpx client (optionally HTTP/2) is shared by every request of the process, so only the
+first request pays for the TCP + TLS handshake. httpcore trace events give each request a
+breakdown of where its latency went.
+"""
+import json
+import os
+import time
+import httpx
+
+HTTP2 = os.getenv("OPENAI_HTTP2") == "1"  # needs the h2 package: pip install "httpx[http2]"
+
+
+class TimedSession:
+    def __init__(self, base_url, headers, http2=HTTP2):
+        self.client = httpx.Client(
+            base_url=base_url,
+            headers=headers,
+            http2=http2,
+            timeout=httpx.Timeout(600, connect=10),
+            limits=httpx.Limits(max_keepalive_connections=4, keepalive_expiry=120),
+        )
+        self.timings = []
+
+    def post_json(self, path, payload):
+        """POST ``payload`` as compact JSON; the response gets a ``timings`` dict (seconds)."""
+        marks = {}
+
+        def trace(event_name, info):
+            # e.g. "connection.connect_tcp.started" -> "connect_tcp.started", same for http11./http2. events
+            marks[event_name.split(".", 1)[1]] = time.perf_counter()
+
+        body = json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        start = time.perf_counter()
+        response = self.client.post(path, content=body, extensions={"trace": trace})
+        end = time.perf_counter()
+
+        def span(name):
+            if f"{name}.started" in marks and f"{name}.complete" in marks:
+                return marks[f"{name}.complete"] - marks[f"{name}.started"]
+            return 0.0
+
+        response.timings = {
+            "reused_connection": "connect_tcp.started" not in marks,
+            "connect": span("connect_tcp"),  # includes DNS resolution, httpcore does not trace it separately
+            "tls": span("start_tls"),
+            "ttfb": marks.get("receive_response_headers.complete", end) - start,
+            "total": end - start,
+            "http_version": response.http_version,
+        }
+        self.timings.append(response.timings)
+        return response
+
+    def summary(self):
+        if not self.timings:
+            return "HTTP session: no requests"
+        new_connections = sum(not timing["reused_connection"] for timing in self.timings)
+        lines = [f"HTTP session: {len(self.timings)} requests, {new_connections} new connections"]
+        for i, timing in enumerate(self.timings, 1):
+            lines.append(f"  #{i} {timing['http_version']} connect={timing['connect'] * 1000:.0f}ms "
+                         f"tls={timing['tls'] * 1000:.0f}ms ttfb={timing['ttfb'] * 1000:.0f}ms "
+                         f"total={timing['total'] * 1000:.0f}ms")
+        return "\n".join(lines)
+
+    def close(self):
+        self.client.close()
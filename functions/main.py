@@ -1,10 +1,21 @@
+import json
 import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 import openai
-import requests
-import sqlite3
 from tenacity import retry, wait_random_exponential, stop_after_attempt
 from dotenv import load_dotenv
 from conversation import Conversation
+from http_session import TimedSession
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common.rate_limiter import estimate_tokens, shared_limiter
+from common.response_cache import request_key, shared_cache
+from common.query_cache import fetch_table, shared_query_cache
+from common.result_format import format_result
+from common.prompt_prefix import PromptPrefix, shared_prefix_stats
+from common.schema_provider import schema_for
 
 
 load_dotenv()
@@ -12,166 +23,179 @@ openai.api_key = os.getenv("OPENAI_API_KEY")
 MODEL = "gpt-4o"
 DATABASE = "db/movies.sqlite"
 USER_MESSAGE = "Hi, what are the directors of top 10 movies with the budget more than 1 mil by user rating"
-
-@retry(wait=wait_random_exponential(min=1, max=40), stop=stop_after_attempt(3))
-def chat_completion_request(messages, functions=None, model=MODEL):
-    headers = {
+MAX_ITERATIONS = 5  # model turns that may request tools before a final answer is forced
+CONVERSATION_TOKEN_BUDGET = int(os.getenv("CONVERSATION_TOKEN_BUDGET", "6000"))  # history re-sent per turn
+tool_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="tool-call")
+
+# shared by the function-calling loop and the SQL-fix retry in call_function
+session = TimedSession(
+    base_url="https://api.openai.com/v1",
+    headers={
         "Content-Type": "application/json",
         "Authorization": "Bearer " + openai.api_key,
-    }
+    },
+)
+
+
+class CachedResponse:
+    """Stands in for an httpx.Response when the completion comes from the response cache."""
+    status_code = 200
+    is_success = True
+    headers = {}
+
+    def __init__(self, text):
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+
+@retry(wait=wait_random_exponential(min=1, max=40), stop=stop_after_attempt(3), reraise=True)
+def chat_completion_request(messages, tools=None, model=MODEL, tool_choice=None):
+    """POST a chat completion; network errors and 429s are retried, then raised."""
+    cache_key = request_key(model=model, messages=messages, tools=tools, tool_choice=tool_choice)
+    cached = shared_cache.get(cache_key) if shared_cache is not None else None
+    if cached is not None:
+        return CachedResponse(cached)
     json_data = {"model": model, "messages": messages}
-    if functions is not None:
-        json_data.update({"functions": functions})
+    if tools is not None:
+        json_data.update({"tools": tools})
+    if tool_choice is not None:
+        json_data.update({"tool_choice": tool_choice})
+    estimated_tokens = estimate_tokens(messages)
+    shared_limiter.acquire(estimated_tokens)
+    try:
+        response = session.post_json("/chat/completions", json_data)
+    except Exception:
+        shared_limiter.record_usage(estimated_tokens, 0)
+        raise
+    shared_limiter.update_from_headers(response.headers)
+    if response.status_code == 429:
+        # the limiter now waits out retry-after, so the tenacity retry is not blind
+        shared_limiter.record_usage(estimated_tokens, 0)
+        response.raise_for_status()
+    if response.is_success:
+        shared_limiter.record_usage(estimated_tokens, response.json()["usage"]["total_tokens"])
+        shared_prefix_stats.record(response.json()["usage"])
+        if shared_cache is not None:
+            shared_cache.set(cache_key, response.text)
+    return response
+
+
+def chat_completion_json(messages, tools=None, tool_choice=None):
+    """Completion body with its choices, or None when the request failed for good."""
     try:
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers=headers,
-            json=json_data,
-        )
-        return response
+        completion = chat_completion_request(messages, tools, tool_choice=tool_choice).json()
+        completion["choices"][0]["message"]  # error bodies of 4xx/5xx responses have no choices
     except Exception as e:
         print("Unable to generate ChatCompletion response")
-        print(f"Exception: {e}")
-        return e
+        print(f"Exception: {e!r}")
+        return None
+    return completion
 
 
 if __name__ == '__main__':
     conversation = Conversation()
-    conn = sqlite3.connect(DATABASE)
 
 
-database_schema_string = """
-Table: movies
-Columns: id, original_title, budget, popularity, release_date, revenue, title, vote_average, overview, tagline, uid, director_id
-Table: directors
-Columns: name, id, gender, uid, department
-"""
+# the whole schema, not a subset picked for USER_MESSAGE: it goes into the byte-identical prompt prefix
+database_schema_string = schema_for(DATABASE)
 
 print(f"Database schema string: '{database_schema_string}'")
 
-functions = [
+tools = [
     {
-        "name": "ask_database",
-        "description": "Use this function to answer user questions about data. Output should be a fully formed SQL query.",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "query": {
-                    "type": "string",
-                    "description": f"""
-                            SQL query extracting info to answer the user's question.
-                            SQL should be written using this database schema:
-                            {database_schema_string}
-                            The query should be returned in plain text, not in JSON.
-                            """,
-                }
+        "type": "function",
+        "function": {
+            "name": "ask_database",
+            "description": "Use this function to answer user questions about data. Output should be a fully formed SQL query.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        # the schema lives in the system prompt so the tool definition never changes
+                        "description": "SQL query extracting info to answer the user's question, written against "
+                                       "the database schema in the system message. Plain text, not JSON.",
+                    }
+                },
+                "required": ["query"],
             },
-            "required": ["query"],
         },
     }
 ]
 
 
-def ask_database(conn, query):
+def ask_database(query):
     """Function to query SQLite database with provided SQL query."""
     try:
-        results = conn.execute(query).fetchall()
-        return results
+        return format_result(*fetch_table(DATABASE, query))
     except Exception as e:
         raise Exception(f"SQL error: {e}")
 
 
-def chat_completion_with_function_execution(messages, functions=None):
-    """This function makes a ChatCompletion API call and if a function call is requested, executes the function"""
+def execute_tool_call(tool_call):
+    """Runs one model tool call; errors go back to the model as the tool result so it can fix its SQL."""
+    name = tool_call["function"]["name"]
     try:
-        response = chat_completion_request(messages, functions)
-        full_message = response.json()["choices"][0]
-        if full_message["finish_reason"] == "function_call":
-            print(f"Function generation requested, calling function")
-            return call_function(messages, full_message)
-        else:
-            print(f"Function not required, responding to user")
-            return response.json()
+        if name != "ask_database":
+            raise Exception(f"Function {name} does not exist and cannot be called")
+        arguments = json.loads(tool_call["function"]["arguments"])
+        print(f"Prepped query is {arguments['query']}")
+        content = ask_database(arguments["query"])
     except Exception as e:
-        print("Unable to generate ChatCompletion response")
-        print(f"Exception: {e}")
-        return response
-
-
-def call_function(messages, full_message):
-    """Executes function calls using model generated function arguments."""
-
-    # We'll add our one function here - this can be extended with any additional functions
-    if full_message["message"]["function_call"]["name"] == "ask_database":
-        query = eval(full_message["message"]["function_call"]["arguments"])
-        print(f"Prepped query is {query}")
-        try:
-            results = ask_database(conn, query["query"])
-        except Exception as e:
-            print(e)
-
-            # This following block tries to fix any issues in query generation with a subsequent call
-            messages.append(
-                {
-                    "role": "system",
-                    "content": f"""Query: {query['query']}
-The previous query received the error {e}. 
-Please return a fixed SQL query in plain text.
-Your response should consist of ONLY the SQL query with the separator sql_start at the beginning and sql_end at the end""",
-                }
-            )
-            response = chat_completion_request(messages, model=MODEL)
-
-            # Retrying with the fixed SQL query. If it fails a second time we exit.
-            try:
-                cleaned_query = response.json()["choices"][0]["message"][
-                    "content"
-                ].split("sql_start")[1]
-                cleaned_query = cleaned_query.split("sql_end")[0]
-                #print(cleaned_query)
-                results = ask_database(conn, cleaned_query)
-                #print(results)
-                print("Got on second try")
-
-            except Exception as e:
-                print("Second failure, exiting")
-
-                print(f"Function execution failed")
-                print(f"Error message: {e}")
-
-        messages.append(
-            {"role": "function", "name": "ask_database", "content": str(results)}
-        )
-
-        try:
-            response = chat_completion_request(messages)
-            return response.json()
-        except Exception as e:
-            print(type(e))
-            print(e)
-            raise Exception("Function chat request failed")
-    else:
-        raise Exception("Function does not exist and cannot be called")
+        print(e)
+        content = f"{e}\nFix the query and call the function again."
+    return {"role": "tool", "tool_call_id": tool_call["id"], "content": content}
+
+
+def chat_completion_with_tool_execution(conversation, tools=None, max_iterations=MAX_ITERATIONS):
+    """Calls the model and runs the tool calls it requests until it answers or the iteration budget is used up.
+
+    Tool calls of one turn run concurrently and their results are appended in the order of the calls,
+    so the conversation can compact older results before the next request.
+    """
+    for iteration in range(1, max_iterations + 1):
+        completion = chat_completion_json(conversation.conversation_history, tools)
+        if completion is None:
+            return None
+        message = completion["choices"][0]["message"]
+        if not message.get("tool_calls"):
+            print(f"Function not required, responding to user")
+            return completion
+        print(f"Turn {iteration}: model requested {len(message['tool_calls'])} tool calls")
+        conversation.append({"role": "assistant", "content": message.get("content"), "tool_calls": message["tool_calls"]})
+        for tool_message in tool_executor.map(execute_tool_call, message["tool_calls"]):
+            conversation.append(tool_message)
+        print(f"Conversation is {conversation.total_tokens} tokens")
+    print(f"Tool budget of {max_iterations} turns used up, asking for a final answer")
+    return chat_completion_json(conversation.conversation_history, tools, tool_choice="none")
 
 
 agent_system_message = """You are DatabaseGPT, a helpful assistant who gets answers to user questions from the Database
-Provide as many details as possible to your users
-Begin!"""
+Provide as many details as possible to your users"""
+# static instructions and schema first, identical on every request; the conversation follows
+prompt_prefix = PromptPrefix(agent_system_message, "Database schema:\n" + database_schema_string, "Begin!")
 
-sql_conversation = Conversation()
-sql_conversation.add_message("system", agent_system_message)
+sql_conversation = Conversation(token_budget=CONVERSATION_TOKEN_BUDGET)
+sql_conversation.add_message("system", prompt_prefix.text)
 sql_conversation.add_message(
     "user", USER_MESSAGE
 )
 
-chat_response = chat_completion_with_function_execution(
-    sql_conversation.conversation_history, functions=functions
+chat_response = chat_completion_with_tool_execution(
+    sql_conversation, tools=tools
 )
-try:
+if chat_response is not None:
     assistant_message = chat_response["choices"][0]["message"]["content"]
-except Exception as e:
-    print(e)
-    print(chat_response)
+else:
+    assistant_message = "Sorry, the model could not be reached, please try again later."
 
 sql_conversation.add_message("assistant", assistant_message)
 sql_conversation.display_conversation(detailed=True)
+if shared_cache is not None:
+    print(shared_cache.summary())
+print(shared_query_cache.summary())
+print(shared_prefix_stats.summary())
+print(session.summary())
+session.close()
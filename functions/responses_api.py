@@ -1,18 +1,20 @@
-import sqlite3
 import json
+import sys
+from pathlib import Path
 from openai import OpenAI
 
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common.query_cache import fetch_table
+from common.result_format import format_result
+from common.prompt_prefix import PromptPrefix, shared_prefix_stats
+from common.schema_provider import schema_for
+
 client = OpenAI()
 
 MODEL = "gpt-4.1"
 DATABASE = "db/movies.sqlite"
 
-database_schema_string = """
-Table: movies
-Columns: id, original_title, budget, popularity, release_date, revenue, title, vote_average, overview, tagline, uid, director_id
-Table: directors
-Columns: name, id, gender, uid, department
-"""
+database_schema_string = schema_for(DATABASE)
 
 tools = [
     {
@@ -24,12 +26,8 @@ tools = [
             "properties": {
                 "query": {
                     "type": "string",
-                    "description": f"""
-                            SQL query extracting info to answer the user's question.
-                            SQL should be written using this database schema:
-                            {database_schema_string}
-                            The query should be returned in plain text, not in JSON.
-                            """,
+                    "description": "SQL query extracting info to answer the user's question, written against "
+                                   "the database schema in the instructions. Plain text, not JSON.",
                 }
             },
             "required": ["query"],
@@ -39,35 +37,46 @@ tools = [
 
 def ask_database(query):
     try:
-        conn = sqlite3.connect(DATABASE)
         print("Executing query: ", query)
-        results = conn.execute(query).fetchall()
+        results = format_result(*fetch_table(DATABASE, query))
         print("Query results: ", results)
         return results
     except Exception as e:
         raise Exception(f"SQL error: {e}")
 
+# both requests send the same tools and instructions, so the second one reuses the cached prefix
+prompt_prefix = PromptPrefix(
+    "Answer questions about movies with the ask_database tool. Respond to the initial user question with the "
+    "database result generated by the tool. Use markdown formatting.",
+    "Database schema:\n" + database_schema_string,
+)
 messages = [
     {"role": "user", "content": "What is the most expensive movie in the database?."}
 ]
 
 response = client.responses.create(
     model=MODEL,
+    instructions=prompt_prefix.text,
     tools=tools,
     input=messages,
 )
+shared_prefix_stats.record(response.usage)
 
 for item in response.output:
     if item.type == "function_call":
         if item.name == "ask_database":
             db_result = ask_database(json.loads(item.arguments)["query"])
-            messages.append({"role": "assistant", "content": str(db_result)})
+            messages.append({"role": "assistant", "content": db_result})
 print("Messages: ", messages)
 
 response = client.responses.create(
     model=MODEL,
-    instructions="Respond to initial user question with a database result generated by a tool. Use markdown formatting.",
+    instructions=prompt_prefix.text,
+    tools=tools,
+    tool_choice="none",
     input=messages,
 )
+shared_prefix_stats.record(response.usage)
 
-print("Final output: " + response.output_text)
\ No newline at end of file
+print("Final output: " + response.output_text)
+print(shared_prefix_stats.summary())
\ No newline at end of file
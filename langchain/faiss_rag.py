@@ -1,66 +1,62 @@
-import faiss
+import os
+import sys
+from pathlib import Path
 from langchain.chat_models import init_chat_model
-from langchain_community.docstore import InMemoryDocstore
 from langchain_community.document_loaders.pdf import PyPDFLoader
-from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common.embeddings import CachedEmbeddings, shared_embedding_cache
+from common.vector_store import VectorStore
 
-embeddings = OpenAIEmbeddings(model="text-embedding-3-large")
-index = faiss.IndexFlatL2(len(embeddings.embed_query("should be 3072 but let's see")))
-vector_store = FAISS(embedding_function=embeddings,
-    index=index,
-    docstore=InMemoryDocstore(),
-    index_to_docstore_id={}
-)
-
-loader = PyPDFLoader(
-    file_path="pdfs/brochure.pdf",
-    mode = "single",
-    pages_delimiter = "\n\f",
-)
-
-docs = []
-docs_lazy = loader.lazy_load()
 
-for doc in docs_lazy:
-    docs.append(doc)
-print(docs[0].page_content[:500])
-print(docs[0].metadata)
-print(f"Total characters: {len(docs[0].page_content)}")
+# batched, concurrent and cached: re-running only embeds chunks whose text changed.
+# EMBEDDING_DIMS (e.g. 256/512/1024) asks for shortened vectors, FAISS_INDEX=SQfp16/SQ8 quantizes them;
+# langchain/rag_eval.py measures what either costs in recall
+embeddings = CachedEmbeddings(model="text-embedding-3-large",
+                              dimensions=int(os.getenv("EMBEDDING_DIMS", "0")) or None)
 
 text_splitter = RecursiveCharacterTextSplitter(
     chunk_size=1000,  # chunk size (characters)
     chunk_overlap=200,  # chunk overlap (characters)
 )
-all_splits = text_splitter.split_documents(docs)
 
-print(f"Split docs into {len(all_splits)} sub-documents.")
 
-document_ids = vector_store.add_documents(all_splits)
-print(document_ids[:3])
-vector_store.save_local("faiss_store")
+def load_chunks(path):
+    loader = PyPDFLoader(
+        file_path=str(path),
+        mode = "single",
+        pages_delimiter = "\n\f",
+    )
+    docs = list(loader.lazy_load())
+    print(f"{path}: {len(docs[0].page_content)} characters")
+    return [(split.page_content, split.metadata) for split in text_splitter.split_documents(docs)]
 
-llm = init_chat_model("gpt-4o-mini", model_provider="openai")
 
-vector_store = FAISS.load_local("faiss_store",
-                                embeddings,
-                                allow_dangerous_deserialization=True)
+# only new, changed or deleted PDFs are chunked and re-indexed
+vector_store = VectorStore.load("faiss_store", embeddings)
+stats = vector_store.sync(sorted(Path("pdfs").glob("*.pdf")), load_chunks)
+print(f"Sources: {stats['unchanged']} unchanged, {stats['added']} added, {stats['updated']} updated, "
+      f"{stats['removed']} removed; {stats['chunks']} chunks indexed, {vector_store.index.ntotal} in total")
+vector_store.save()
+if shared_embedding_cache is not None:
+    print(shared_embedding_cache.summary())
+
+llm = init_chat_model("gpt-4o-mini", model_provider="openai")
 
-results = vector_store.similarity_search_with_relevance_scores("Does TRD Pro have moonroof?", k=3)
+results = vector_store.search("Does TRD Pro have moonroof?", k=3)
 
 context = ""
 
-for document in results:
-    print(document)
-    context += context + f" CONTENT: {document[0].page_content} SOURCE: {document[0].metadata}"
+for text, metadata, distance in results:
+    print(distance, metadata, text[:200])
+    context += f" CONTENT: {text} SOURCE: {metadata}"
     print("\n")
 
 print(context)
-rag_prompt = '''You are an assistant for question-answering tasks. Use the following pieces of retrieved context to 
-answer the question. If you don't know the answer, just say that you don't know. Always mention the 'source' and 
+rag_prompt = '''You are an assistant for question-answering tasks. Use the following pieces of retrieved context to
+answer the question. If you don't know the answer, just say that you don't know. Always mention the 'source' and
 'title' of the document you use context from. Question: {question} Context: {context} Answer:'''
 llm_response = llm.invoke(rag_prompt.format(question="Does TRD Pro have moonroof?", context=context))
 print(llm_response)
-print('FINAL ANSWER: ' + llm_response.content)
\ No newline at end of file
+print('FINAL ANSWER: ' + llm_response.content)
@@ -0,0 +1,91 @@
+"""Recall@k of the brochure RAG store for reduced-dimension and quantized embeddings.
+
+Every question in brochure_questions.jsonl lists phrases of the brochure that answer it; a
+retrieved chunk is relevant if it contains one of them (case and whitespace ignored), and
+recall@k is the share of questions with a relevant chunk in the top k. Chunks and questions
+are embedded once at full size through the embedding cache. Shorter vectors are the first
+``dimensions`` values re-normalized, which is what the ``dimensions`` API parameter returns,
+so no extra requests are needed. Each size is indexed with each quantizer, and memory per
+vector, search time and recall are printed next to the full-size float32 baseline.
+
+    python rag_eval.py
+    python rag_eval.py --dims 3072 1024 512 256 --specs Flat SQfp16 SQ8 --k 1 3 5
+"""
+import argparse
+import json
+import re
+import sys
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+from langchain_community.document_loaders.pdf import PyPDFLoader
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common.ann_index import create_index, train_if_needed
+from common.embeddings import EMBEDDING_DIMENSIONS, embed_texts
+
+MODEL = "text-embedding-3-large"
+PDF = "pdfs/brochure.pdf"
+QUESTIONS = Path(__file__).with_name("brochure_questions.jsonl")
+
+
+def normalize(text):
+    return re.sub(r"\s+", " ", text).casefold()
+
+
+def load_chunks(path=PDF):
+    # same loader and splitter settings as faiss_rag.py, so the chunks match the store
+    docs = list(PyPDFLoader(file_path=path, mode="single", pages_delimiter="\n\f").lazy_load())
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+    return [split.page_content for split in splitter.split_documents(docs)]
+
+
+def shorten(vectors, dimensions):
+    """First ``dimensions`` values of each vector, scaled back to unit length."""
+    shortened = np.ascontiguousarray(vectors[:, :dimensions])
+    return shortened / np.linalg.norm(shortened, axis=1, keepdims=True)
+
+
+def evaluate(chunks, questions, dims, specs, ks):
+    chunk_vectors = np.array(embed_texts(chunks, MODEL), dtype="float32")
+    question_vectors = np.array(embed_texts([q["question"] for q in questions], MODEL), dtype="float32")
+    normalized_chunks = [normalize(chunk) for chunk in chunks]
+    relevant = [{i for i, chunk in enumerate(normalized_chunks) if any(normalize(p) in chunk for p in q["relevant"])}
+                for q in questions]
+    unlabelled = [q["question"] for q, ids in zip(questions, relevant) if not ids]
+    if unlabelled:
+        print(f"No chunk contains the labels of: {unlabelled}")
+
+    print(f"{len(chunks)} chunks, {len(questions)} questions")
+    print(f"{'dims':>5} {'spec':8} {'bytes/vec':>9} {'ms/query':>8} " + " ".join(f"{f'R@{k}':>6}" for k in ks))
+    results = []
+    for dimensions in dims:
+        base = shorten(chunk_vectors, dimensions)
+        queries = shorten(question_vectors, dimensions)
+        for spec in specs:
+            index = create_index(spec, dimensions)
+            train_if_needed(index, base)
+            index.add_with_ids(base, np.arange(len(base), dtype="int64"))
+            start = time.perf_counter()
+            _, found = index.search(queries, max(ks))
+            ms_per_query = (time.perf_counter() - start) * 1000 / len(queries)
+            recall = {k: np.mean([bool(set(row[:k]) & ids) for row, ids in zip(found, relevant)]) for k in ks}
+            bytes_per_vector = faiss.serialize_index(index).nbytes / len(base)
+            results.append((dimensions, spec, bytes_per_vector, ms_per_query, recall))
+            print(f"{dimensions:5} {spec:8} {bytes_per_vector:9.0f} {ms_per_query:8.3f} "
+                  + " ".join(f"{recall[k]:6.2f}" for k in ks))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dims", type=int, nargs="*", default=[EMBEDDING_DIMENSIONS[MODEL], 1024, 512, 256])
+    parser.add_argument("--specs", nargs="*", default=["Flat", "SQfp16", "SQ8"], help="FAISS factory strings")
+    parser.add_argument("--k", type=int, nargs="*", default=[1, 3, 5])
+    parser.add_argument("--pdf", default=PDF)
+    args = parser.parse_args()
+    labelled = [json.loads(line) for line in QUESTIONS.read_text(encoding="utf-8").splitlines() if line.strip()]
+    evaluate(load_chunks(args.pdf), labelled, args.dims, args.specs, args.k)
@@ -1,20 +1,20 @@
 import asyncio
-import json
 import os
-import sqlite3
+import sys
+from pathlib import Path
 from semantic_kernel.connectors.ai import FunctionChoiceBehavior
 from semantic_kernel.connectors.ai.open_ai import OpenAIChatCompletion, OpenAIChatPromptExecutionSettings
 from semantic_kernel.contents import ChatHistory
 from semantic_kernel.functions import kernel_function, KernelArguments
 from semantic_kernel import Kernel
 
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common.query_cache import fetch_table
+from common.result_format import format_result
+from common.schema_provider import schema_for
+
 DB_PATH = "db/movies.sqlite"
-database_schema_string = """
-Table: movies
-Columns: id, original_title, budget, popularity, release_date, revenue, title, vote_average, overview, tagline, uid, director_id
-Table: directors
-Columns: name, id, gender, uid, department
-"""
+database_schema_string = schema_for(DB_PATH)
 
 class DatabasePlugin:
     @kernel_function(name="AskDatabase", description="Ask the database a question.")
@@ -22,12 +22,7 @@ class DatabasePlugin:
         # The 'arguments' parameter is reserved and automatically populated with KernelArguments.
         print("Executing SQL Query: ", query)
         try:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            cursor.execute(query)
-            results = cursor.fetchall()
-            conn.close()
-            return json.dumps(results)
+            return format_result(*fetch_table(DB_PATH, query))
         except Exception as e:
             return str(e)
 
@@ -1,40 +1,41 @@
-import json
-import sqlite3
-import requests
+import asyncio
 import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import httpx
 from langchain.chat_models import init_chat_model
 from langchain_core.tools import tool
-from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.messages import HumanMessage, SystemMessage, ToolMessage
 from dotenv import load_dotenv
 
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common.query_cache import fetch_table
+from common.result_format import format_result
+from common.prompt_prefix import PromptPrefix, shared_prefix_stats
+from common.schema_provider import schema_for
+
 
 load_dotenv()
 token = os.getenv("GITHUB_TOKEN")
 
 llm = init_chat_model("gpt-4o-mini", model_provider="openai")
 DB_PATH = "db/movies.sqlite"
-database_schema_string = """
-Table: movies
-Columns: id, original_title, budget, popularity, release_date, revenue, title, vote_average, overview, tagline, uid, director_id
-Table: directors
-Columns: name, id, gender, uid, department
-"""
+# tool calls of one model turn run concurrently: SQLite work on this pool, HTTP on the event loop
+sql_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="ask-database")
+TOOL_TIMEOUT_SECONDS = {"ask_database": 10, "create_github_issue": 20}
+database_schema_string = schema_for(DB_PATH)
 
 @tool
 def ask_database(sql_query: str) -> str:
     """Executes a SQL query against the SQLite database and returns results."""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute(sql_query)
-        results = cursor.fetchall()
-        conn.close()
-        return json.dumps(results)
+        return format_result(*fetch_table(DB_PATH, sql_query))
     except Exception as e:
         return str(e)
 
 @tool
-def create_github_issue(title, body):
+async def create_github_issue(title, body):
     """
     Creates an issue in the given GitHub repository and returns its title and URL.
 
@@ -54,7 +55,8 @@ def create_github_issue(title, body):
         "body": body
     }
 
-    response = requests.post(url, headers=headers, json=data)
+    async with httpx.AsyncClient() as client:
+        response = await client.post(url, headers=headers, json=data)
 
     if response.status_code == 201:
         issue_data = response.json()
@@ -72,26 +74,51 @@ llm_with_tools = llm.bind_tools(tools)
 
 # query = "Can you create a support ticket for me? I want to add movies released in 2024."
 query = "I want to add new movies released in 2024 to the database. Can you help me with that?"
-system_message = SystemMessage('If the question is related to movies, use ask_database tool. It can execute SQL '
-                               'against the SQLite database and return results. Here is the database schema: ' +
-                               database_schema_string +
-                               ' You can also create a support tickets using create_github_issue tool if needed. '
-                               'Construct the summary and description of the ticket based on the previous user '
-                               'message and call the tool. Do not ask user for additional information.  '
-                               )
-messages = [system_message,
+# static instructions and schema first so both model calls share a cacheable prefix
+prompt_prefix = PromptPrefix(
+    "If the question is related to movies, use ask_database tool. It can execute SQL against the SQLite database "
+    "and return results. You can also create a support tickets using create_github_issue tool if needed. "
+    "Construct the summary and description of the ticket based on the previous user message and call the tool. "
+    "Do not ask user for additional information.",
+    "Database schema:\n" + database_schema_string,
+)
+messages = [SystemMessage(prompt_prefix.text),
             HumanMessage(query)]
 ai_msg = llm_with_tools.invoke(messages)
+shared_prefix_stats.record(ai_msg.usage_metadata)
 print(ai_msg)
 
 messages.append(ai_msg)
 
-for tool_call in ai_msg.tool_calls:
-    selected_tool = {"ask_database": ask_database, "create_github_issue": create_github_issue}[tool_call["name"].lower()]
-    tool_msg = selected_tool.invoke(tool_call)
+async def run_tool_call(tool_call):
+    """Run one tool call with its timeout; a timeout or error is reported to the model as the tool result."""
+    name = tool_call["name"].lower()
+    selected_tool = {"ask_database": ask_database, "create_github_issue": create_github_issue}[name]
+    if selected_tool.coroutine is not None:
+        call = selected_tool.ainvoke(tool_call)
+    else:
+        call = asyncio.get_running_loop().run_in_executor(sql_executor, selected_tool.invoke, tool_call)
+    try:
+        return await asyncio.wait_for(call, TOOL_TIMEOUT_SECONDS[name])
+    except asyncio.TimeoutError:
+        return ToolMessage(content=f"{name} timed out after {TOOL_TIMEOUT_SECONDS[name]} seconds",
+                           tool_call_id=tool_call["id"], status="error")
+    except Exception as e:
+        # e.g. an httpx error from the GitHub API; the other calls of the turn still complete
+        return ToolMessage(content=f"{name} failed: {e!r}", tool_call_id=tool_call["id"], status="error")
+
+
+async def run_tool_calls(tool_calls):
+    """Run all tool calls of a model turn concurrently; results keep the order of the calls."""
+    return await asyncio.gather(*(run_tool_call(tool_call) for tool_call in tool_calls))
+
+
+for tool_msg in asyncio.run(run_tool_calls(ai_msg.tool_calls)):
     print('\n tool_msg', tool_msg)
     messages.append(tool_msg)
 
 result = llm_with_tools.invoke(messages)
+shared_prefix_stats.record(result.usage_metadata)
 print(result)
-print('\n FINAL RESULT:', result.content)
\ No newline at end of file
+print('\n FINAL RESULT:', result.content)
+print(shared_prefix_stats.summary())
\ No newline at end of file
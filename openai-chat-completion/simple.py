@@ -1,7 +1,17 @@
+import sys
+from pathlib import Path
 from openai import OpenAI
+from openai.types.chat import ChatCompletion
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common.response_cache import cached_completion
+
 client = OpenAI()
 
-completion = client.chat.completions.create(
+# seed + fixed parameters make the request repeatable, so re-runs are served from the cache
+completion = cached_completion(
+  client.chat.completions.create,
+  ChatCompletion,
   model="gpt-4o",
   max_tokens=100,
   seed=42,
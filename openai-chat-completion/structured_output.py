@@ -1,5 +1,11 @@
+import sys
+from pathlib import Path
 from pydantic import BaseModel
 from openai import OpenAI
+from openai.types.chat import ParsedChatCompletion
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common.response_cache import cached_completion
 
 client = OpenAI()
 
@@ -15,7 +21,9 @@ class Clients(BaseModel):
     persons: list[Person]
 
 
-completion = client.beta.chat.completions.parse(
+completion = cached_completion(
+    client.beta.chat.completions.parse,
+    ParsedChatCompletion[Clients],
     model="gpt-4o-2024-08-06",
     messages=[
         {"role": "system", "content": "You are a helpful assistant."},
@@ -1,18 +1,45 @@
+import asyncio
+import os
+import httpx
 import openai
 
 
-client = openai.Client(
-    base_url="http://localhost:1234/v1/"
-)
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "4"))  # sequences the local server runs at once
 
-response = client.chat.completions.create(
-    model="phi-4",
-    temperature=0.5,
-    max_tokens=1024,
-    messages=[
-        {"role": "system", "content": "You are a helpful assistant."},
-        {"role": "user", "content": "What is the fastest car in the world?"},
-    ]
+client = openai.AsyncOpenAI(
+    base_url="http://localhost:1234/v1/",
+    http_client=httpx.AsyncClient(limits=httpx.Limits(max_connections=MAX_CONCURRENT_REQUESTS,
+                                                      max_keepalive_connections=MAX_CONCURRENT_REQUESTS)),
 )
+semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+QUESTIONS = [
+    "What is the fastest car in the world?",
+    "What is the fastest train in the world?",
+]
+
+
+async def complete(question):
+    async with semaphore:
+        response = await client.chat.completions.create(
+            model="phi-4",
+            temperature=0.5,
+            max_tokens=1024,
+            messages=[
+                {"role": "system", "content": "You are a helpful assistant."},
+                {"role": "user", "content": question},
+            ]
+        )
+    return response.choices[0].message.content
+
+
+async def main():
+    # questions are sent concurrently, the local server batches them instead of idling between requests
+    async with client:
+        answers = await asyncio.gather(*(complete(question) for question in QUESTIONS))
+    for answer in answers:
+        print(answer)
+
 
-print(response.choices[0].message.content)
\ No newline at end of file
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,15 +1,49 @@
+import asyncio
+import json
+import os
+import sys
+from functools import partial
+from pathlib import Path
+import httpx
 import openai
-from pydantic import BaseModel, Field
+from openai.types.chat import ParsedChatCompletion
+from pydantic import BaseModel, Field, ValidationError
 
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common.batch_runner import iter_batch_results, response_format_for
+from common.rate_limiter import call_with_rate_limit, call_with_rate_limit_async, count_tokens
+from common.response_cache import cached_completion, shared_cache
+
+# retries go through call_with_rate_limit so every attempt is reserved in the shared limiter
 client = openai.Client(
-    base_url="http://localhost:1234/v1/"
+    base_url="http://localhost:1234/v1/",
+    max_retries=0,
+)
+ASYNC_MODE = os.getenv("ASYNC_MODE") == "1"  # tag reviews concurrently with the async client
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "4"))  # sequences the local server runs at once
+CALL_RETRIES = 2  # extra attempts after a 429, 5xx or dropped connection
+# one keep-alive connection per concurrent request, shared by the whole async pipeline
+async_client = openai.AsyncOpenAI(
+    base_url="http://localhost:1234/v1/",
+    max_retries=0,
+    http_client=httpx.AsyncClient(limits=httpx.Limits(max_connections=MAX_CONCURRENT_REQUESTS,
+                                                      max_keepalive_connections=MAX_CONCURRENT_REQUESTS)),
 )
+# the local server has no Batch API, batch mode goes to OPENAI_BASE_URL (OpenAI or the stub server)
+batch_client = openai.Client()
+BATCH_MODE = os.getenv("BATCH_MODE") == "1"
+BATCH_MODEL = os.getenv("BATCH_MODEL", "gpt-4o-mini")
+MULTI_REVIEW_MODE = os.getenv("MULTI_REVIEW_MODE") == "1"  # pack several reviews into one request
+REVIEWS_TOKEN_BUDGET = int(os.getenv("REVIEWS_TOKEN_BUDGET", "3000"))  # input + output tokens per packed request
+TAGGED_REVIEW_OVERHEAD_TOKENS = 80  # JSON keys and ratings of one ReviewTagged in the output
 
 custom_prompt = ('''You are review analyzing agent. Your goal is to tag the review. Read the review below, analyze and 
                  tag by the scale from 0 to 5 how this affects each category. If you don't have enough data use 0. 1 
                  is bad, 2 is so-so, 3 is ok, 4 is good, 5 is excellent. The categories are: price, quality, 
                  delivery, customer service, and overall satisfaction.
                  ''')
+multi_review_instructions = '''You will get a JSON list of reviews, each with an id and a review text. Tag 
+                 every review separately and return one entry per review with the same id.'''
 
 
 class ReviewTagged(BaseModel):
@@ -23,8 +57,80 @@ class ReviewTagged(BaseModel):
     insufficient_data: bool = Field(description="If the model does not have enough data to make a review tagging")
 
 
+class ReviewTaggedList(BaseModel):
+    reviews: list[ReviewTagged] = Field(description="One tagged entry per input review")
+
+
 def analyze_feedback(review, custom_prompt):
-    response = client.beta.chat.completions.parse(
+    response = cached_completion(
+        partial(call_with_rate_limit, client.beta.chat.completions.with_raw_response.parse, retries=CALL_RETRIES),
+        ParsedChatCompletion[ReviewTagged],
+        model="phi-4",
+        messages=[
+            {"role": "system", "content": custom_prompt},
+            {"role": "user", "content": review}
+        ],
+        temperature=0.3,
+        response_format=ReviewTagged,
+    )
+    return response.choices[0].message.parsed
+
+
+def pack_reviews(reviews, token_budget=REVIEWS_TOKEN_BUDGET, system_message=""):
+    """Split (id, review) pairs into groups whose estimated input + output tokens fit the budget.
+
+    ``system_message`` is sent with every group, so its tokens are taken off the budget first.
+    """
+    token_budget -= count_tokens(system_message)
+    group, group_tokens = [], 0
+    for review_id, review in reviews:
+        # the review is sent once and echoed once in the tagged output
+        review_tokens = 2 * count_tokens(review) + TAGGED_REVIEW_OVERHEAD_TOKENS
+        if group and group_tokens + review_tokens > token_budget:
+            yield group
+            group, group_tokens = [], 0
+        group.append((review_id, review))
+        group_tokens += review_tokens
+    if group:
+        yield group
+
+
+def analyze_feedback_multi(reviews, custom_prompt):
+    """Tag reviews several per request; a group that fails validation is retried one review at a time."""
+    tagged_by_id = {}
+    system_message = custom_prompt + multi_review_instructions
+    for group in pack_reviews(enumerate(reviews), system_message=system_message):
+        try:
+            response = cached_completion(
+                partial(call_with_rate_limit, client.beta.chat.completions.with_raw_response.parse,
+                        retries=CALL_RETRIES),
+                ParsedChatCompletion[ReviewTaggedList],
+                model="phi-4",
+                messages=[
+                    {"role": "system", "content": system_message},
+                    {"role": "user", "content": json.dumps([{"id": i, "review": r} for i, r in group])}
+                ],
+                temperature=0.3,
+                response_format=ReviewTaggedList,
+            )
+            parsed = response.choices[0].message.parsed
+            group_tagged = {tagged.id: tagged for tagged in parsed.reviews} if parsed else {}
+            if group_tagged.keys() != {i for i, _ in group}:
+                raise ValueError(f"expected ids {[i for i, _ in group]}, got {list(group_tagged)}")
+        except (ValueError, openai.LengthFinishReasonError) as e:
+            print(f"Packed request for {len(group)} reviews failed ({e}), tagging them one by one")
+            group_tagged = {}
+            for i, review in group:
+                tagged = analyze_feedback(review, custom_prompt)
+                group_tagged[i] = tagged.model_copy(update={"id": i}) if tagged else tagged
+        tagged_by_id.update(group_tagged)
+    return [tagged_by_id[i] for i in range(len(reviews))]
+
+
+async def analyze_feedback_async(review, custom_prompt):
+    response = await call_with_rate_limit_async(
+        async_client.beta.chat.completions.with_raw_response.parse,
+        retries=CALL_RETRIES,
         model="phi-4",
         messages=[
             {"role": "system", "content": custom_prompt},
@@ -36,6 +142,79 @@ def analyze_feedback(review, custom_prompt):
     return response.choices[0].message.parsed
 
 
+async def analyze_feedback_stream(reviews, custom_prompt, ordered=True, max_concurrency=MAX_CONCURRENT_REQUESTS):
+    """Tag an iterable of reviews concurrently and yield ReviewTagged results as they complete.
+
+    ``id`` of each result is the position of its review. With ``ordered=True`` results are yielded in
+    input order, otherwise in completion order. At most ``max_concurrency`` requests are in flight and
+    reviews are only read from the iterable as slots free up.
+    """
+    async def tag(i, review):
+        tagged = await analyze_feedback_async(review, custom_prompt)
+        return i, tagged.model_copy(update={"id": i}) if tagged else None
+
+    pending = set()
+    completed = {}
+    next_id = 0
+    reviews = enumerate(reviews)
+    try:
+        while True:
+            for i, review in reviews:
+                pending.add(asyncio.create_task(tag(i, review)))
+                if len(pending) >= max_concurrency:
+                    break
+            if not pending:
+                break
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                i, tagged = task.result()
+                if not ordered:
+                    yield tagged
+                else:
+                    completed[i] = tagged
+            while next_id in completed:
+                yield completed.pop(next_id)
+                next_id += 1
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def analyze_feedback_all_async(reviews, custom_prompt):
+    try:
+        return [tagged async for tagged in analyze_feedback_stream(reviews, custom_prompt)]
+    finally:
+        await async_client.close()
+
+
+def analyze_feedback_batch(reviews, custom_prompt):
+    """Tag all reviews with one Batch API job; results keep the order of ``reviews``, None if a review failed.
+
+    As in the other modes ``id`` is the position of the review, not the id the model wrote back.
+    """
+    requests = (('review-' + str(i), {
+        "model": BATCH_MODEL,
+        "messages": [
+            {"role": "system", "content": custom_prompt},
+            {"role": "user", "content": review}
+        ],
+        "temperature": 0.3,
+        "response_format": response_format_for(ReviewTagged),
+    }) for i, review in enumerate(reviews))
+    tagged_reviews = [None] * len(reviews)
+    for custom_id, body in iter_batch_results(batch_client, requests):
+        if body is None:
+            continue
+        i = int(custom_id.split('-')[1])
+        try:
+            tagged = ReviewTagged.model_validate_json(body["choices"][0]["message"]["content"])
+        except ValidationError as e:
+            print(f"Batch result {custom_id} is not a valid ReviewTagged: {e}")
+            continue
+        tagged_reviews[i] = tagged.model_copy(update={"id": i})
+    return tagged_reviews
+
+
 if __name__ == '__main__':
     reviews = [
         'The product was great, but the delivery was slow. The customer service was helpful, but the price was too high.',
@@ -43,9 +222,18 @@ if __name__ == '__main__':
         'The product was okay, but the delivery was late. The customer service was okay, but the price was high.',
         'The product was good, but the delivery was on time. The customer service was excellent, but the price was reasonable.',
         'Can I just have a slice of pizza? Thanks.']
-    tagged_reviews = []
-    for review in reviews:
-        tag_info = analyze_feedback(review, custom_prompt)
-        tagged_reviews.append(tag_info)
+    if BATCH_MODE:
+        tagged_reviews = analyze_feedback_batch(reviews, custom_prompt)
+    elif ASYNC_MODE:
+        tagged_reviews = asyncio.run(analyze_feedback_all_async(reviews, custom_prompt))
+    elif MULTI_REVIEW_MODE:
+        tagged_reviews = analyze_feedback_multi(reviews, custom_prompt)
+    else:
+        tagged_reviews = []
+        for review in reviews:
+            tag_info = analyze_feedback(review, custom_prompt)
+            tagged_reviews.append(tag_info)
 
-    print(tagged_reviews)
\ No newline at end of file
+    print(tagged_reviews)
+    if shared_cache is not None:
+        print(shared_cache.summary())
\ No newline at end of file
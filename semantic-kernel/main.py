@@ -1,6 +1,6 @@
 import asyncio
-import json
-import sqlite3
+import sys
+from pathlib import Path
 
 from semantic_kernel import Kernel
 from semantic_kernel.agents import ChatCompletionAgent
@@ -9,13 +9,14 @@ from semantic_kernel.connectors.ai.open_ai import OpenAIChatCompletion
 from semantic_kernel.contents import ChatHistory, FunctionCallContent, FunctionResultContent
 from semantic_kernel.functions import KernelArguments, kernel_function
 
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common.query_cache import fetch_table
+from common.result_format import format_result
+from common.prompt_prefix import PromptPrefix, shared_prefix_stats
+from common.schema_provider import schema_for
+
 DB_PATH = "db/movies.sqlite"
-database_schema_string = """
-Table: movies
-Columns: id, original_title, budget, popularity, release_date, revenue, title, vote_average, overview, tagline, uid, director_id
-Table: directors
-Columns: name, id, gender, uid, department
-"""
+database_schema_string = schema_for(DB_PATH)
 
 
 class DatabasePlugin:
@@ -23,14 +24,10 @@ class DatabasePlugin:
     def ask_database(self, sql_query: str) -> str:
         """Executes a SQL query against the SQLite database and returns results."""
         try:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
             print('SQL to be executed: ' + sql_query)
-            cursor.execute(sql_query)
-            results = cursor.fetchall()
+            results = format_result(*fetch_table(DB_PATH, sql_query))
             print(results)
-            conn.close()
-            return json.dumps(results)
+            return results
         except Exception as e:
             return str(e)
 
@@ -48,8 +45,11 @@ settings.function_choice_behavior = FunctionChoiceBehavior.Auto()
 
 # Define the agent name and instructions
 AGENT_NAME = "MovieAgent"
-AGENT_INSTRUCTIONS = ("If the question is related to movies, use the 'ask_database' tool. It can execute SQL against "
-                      "the SQLite database and return results. Here is the database schema: ") + database_schema_string
+AGENT_INSTRUCTIONS = PromptPrefix(
+    "If the question is related to movies, use the 'ask_database' tool. It can execute SQL against "
+    "the SQLite database and return results.",
+    "Database schema:\n" + database_schema_string,
+).text
 # Create the agent
 agent = ChatCompletionAgent(
     service_id=service_id,
@@ -70,6 +70,8 @@ async def main():
     agent_name: str | None = None
     print("# Assistant: ", end="")
     async for content in agent.invoke_stream(chat_history):
+        # the final chunk of each streamed completion carries the usage
+        shared_prefix_stats.record(content.metadata.get("usage"))
         if not agent_name:
             agent_name = content.name
             print(f"{agent_name}: '", end="")
@@ -78,6 +80,8 @@ async def main():
                 and content.content.strip()
         ):
             print(f"{content.content}", end="", flush=True)
+    print()
+    print(shared_prefix_stats.summary())
 
 
 if __name__ == "__main__":